@@ -0,0 +1,43 @@
+class FenwickTree(object):
+    """Binary indexed tree over date ordinals
+
+    Keeps prefix sums of per-day values, so sum over any
+    date range is answered in O(log n) and a single day
+    can be updated in O(log n). Tree is sparse (dict backed),
+    only nodes on update paths are stored, so it can be
+    indexed directly by date.toordinal() values.
+    """
+
+    # date.max.toordinal() is 3652059, so 2 ** 22 covers every date
+    size = 1 << 22
+
+    def __init__(self):
+        self.tree = {}
+
+    def add(self, index, value):
+        """Add value to position index
+
+        Params:
+            * index -> int -> Position, must be in range 1..size-1
+            * value -> float -> Value to add
+        """
+        tree = self.tree
+        while index < self.size:
+            tree[index] = tree.get(index, 0) + value
+            index += index & -index
+
+    def prefix_sum(self, index):
+        """Return sum of positions 1..index"""
+        tree = self.tree
+        total = 0
+        index = min(index, self.size - 1)
+        while index > 0:
+            total += tree.get(index, 0)
+            index -= index & -index
+        return total
+
+    def range_sum(self, lo, hi):
+        """Return sum of positions lo..hi (both inclusive)"""
+        if hi < lo:
+            return 0
+        return self.prefix_sum(hi) - self.prefix_sum(lo - 1)
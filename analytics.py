@@ -0,0 +1,189 @@
+from datetime import date
+import helper_methods
+
+try:
+    import numpy
+except ImportError:  # analytics fall back to pure python
+    numpy = None
+
+# Analytics engines answer bulk questions about finished sessions:
+# totals, per day/week/month histograms and moving averages.
+# Every result is list of tuples of python numbers, so both
+# engines are interchangeable. Dates are date ordinals, lo and hi
+# bounds are inclusive and None means unbounded, and seconds are
+# split at midnights like in SessionManager day totals. Buckets
+# are keyed by ordinal of their first day, weeks start on Monday.
+
+BUCKETS = ("day", "week", "month")
+
+
+def bucket_of(ordinal, bucket):
+    """Return ordinal of first day of bucket date ordinal is in"""
+    if bucket == "day":
+        return ordinal
+    if bucket == "week":
+        # date.fromordinal(1) is Monday
+        return ordinal - (ordinal - 1) % 7
+    if bucket == "month":
+        return date.fromordinal(ordinal).replace(day=1).toordinal()
+    raise ValueError("Bucket must be one of %s" % ", ".join(BUCKETS))
+
+
+def next_bucket(key, bucket):
+    """Return ordinal of first day of bucket after the one at key"""
+    if bucket == "day":
+        return key + 1
+    if bucket == "week":
+        return key + 7
+    day = date.fromordinal(key)
+    if day.month == 12:
+        return date(day.year + 1, 1, 1).toordinal()
+    return date(day.year, day.month + 1, 1).toordinal()
+
+
+class PythonEngine(object):
+    """Analytics over per-day totals kept by SessionManager"""
+
+    name = "python"
+
+    def __init__(self, session_manager):
+        session_manager.ensure_loaded()
+        self.day_totals = session_manager.day_totals
+
+    def daily(self, lo=None, hi=None):
+        """Return [(ordinal, unpaid, paid)] seconds of days with sessions"""
+        return sorted((ordinal, unpaid, paid) for ordinal, (unpaid, paid)
+                      in self.day_totals.items()
+                      if (lo is None or ordinal >= lo) and
+                      (hi is None or ordinal <= hi))
+
+    def totals(self, lo=None, hi=None):
+        """Return (unpaid, paid) seconds"""
+        unpaid, paid = 0.0, 0.0
+        for ordinal, day_unpaid, day_paid in self.daily(lo, hi):
+            unpaid += day_unpaid
+            paid += day_paid
+        return unpaid, paid
+
+    def histogram(self, bucket, lo=None, hi=None):
+        """Return [(bucket ordinal, unpaid, paid)] seconds per bucket"""
+        buckets = {}
+        for ordinal, unpaid, paid in self.daily(lo, hi):
+            totals = buckets.setdefault(bucket_of(ordinal, bucket), [0, 0])
+            totals[0] += unpaid
+            totals[1] += paid
+        return [(key, float(unpaid), float(paid))
+                for key, (unpaid, paid) in sorted(buckets.items())]
+
+    def moving_average(self, window, lo, hi):
+        """Return [(ordinal, hours)] of hours per day over window days
+
+        Average for every day in lo..hi is taken over window days
+        ending with it.
+        """
+        result = []
+        total = 0.0
+        for ordinal in range(lo - window + 1, hi + 1):
+            total += sum(self.day_totals.get(ordinal, (0.0, 0.0)))
+            if ordinal - window >= lo - window + 1:
+                total -= sum(self.day_totals.get(ordinal - window,
+                                                 (0.0, 0.0)))
+            if ordinal >= lo:
+                result.append((ordinal, total / window / 3600))
+        return result
+
+
+class NumpyEngine(object):
+    """Vectorized analytics over dense per-day arrays
+
+    Day totals kept by SessionManager are copied into dense
+    arrays of unpaid and paid seconds, one item per day, so
+    building engine costs the number of days, not sessions,
+    and every query is few array operations.
+    """
+
+    name = "numpy"
+
+    def __init__(self, session_manager):
+        session_manager.ensure_loaded()
+        day_totals = session_manager.day_totals
+        self.first_day = helper_methods.EPOCH_ORDINAL
+        if not day_totals:
+            self.unpaid = self.paid_seconds = numpy.zeros(0)
+            return
+        ordinals = numpy.fromiter(day_totals.keys(), dtype=numpy.int64,
+                                  count=len(day_totals))
+        totals = numpy.array(list(day_totals.values()), dtype=numpy.float64)
+        self.first_day = int(ordinals.min())
+        days = ordinals - self.first_day
+        size = int(days.max()) + 1
+        self.unpaid = numpy.zeros(size)
+        self.paid_seconds = numpy.zeros(size)
+        self.unpaid[days] = totals[:, 0]
+        self.paid_seconds[days] = totals[:, 1]
+
+    def window(self, lo, hi):
+        """Return (first ordinal, unpaid, paid) arrays of days lo..hi"""
+        size = len(self.unpaid)
+        start = 0 if lo is None else min(max(lo - self.first_day, 0), size)
+        stop = size if hi is None else min(max(hi - self.first_day + 1,
+                                               start), size)
+        return (self.first_day + start, self.unpaid[start:stop],
+                self.paid_seconds[start:stop])
+
+    def daily(self, lo=None, hi=None):
+        """Return [(ordinal, unpaid, paid)] seconds of days with sessions"""
+        first, unpaid, paid = self.window(lo, hi)
+        days = numpy.nonzero(unpaid + paid)[0]
+        return list(zip((first + days).tolist(), unpaid[days].tolist(),
+                        paid[days].tolist()))
+
+    def totals(self, lo=None, hi=None):
+        """Return (unpaid, paid) seconds"""
+        first, unpaid, paid = self.window(lo, hi)
+        return float(unpaid.sum()), float(paid.sum())
+
+    def histogram(self, bucket, lo=None, hi=None):
+        """Return [(bucket ordinal, unpaid, paid)] seconds per bucket"""
+        first, unpaid, paid = self.window(lo, hi)
+        ordinals = first + numpy.arange(len(unpaid))
+        if bucket == "day":
+            keys = ordinals
+        elif bucket == "week":
+            keys = ordinals - (ordinals - 1) % 7
+        elif bucket == "month":
+            epoch_days = (ordinals - helper_methods.EPOCH_ORDINAL).astype(
+                'datetime64[D]')
+            keys = (epoch_days.astype('datetime64[M]').astype(
+                'datetime64[D]').astype(numpy.int64) +
+                helper_methods.EPOCH_ORDINAL)
+        else:
+            raise ValueError("Bucket must be one of %s" % ", ".join(BUCKETS))
+        if len(keys) == 0:
+            return []
+        starts = numpy.flatnonzero(numpy.r_[True, keys[1:] != keys[:-1]])
+        unpaid = numpy.add.reduceat(unpaid, starts)
+        paid = numpy.add.reduceat(paid, starts)
+        used = numpy.nonzero(unpaid + paid)[0]
+        return list(zip(keys[starts][used].tolist(), unpaid[used].tolist(),
+                        paid[used].tolist()))
+
+    def moving_average(self, window, lo, hi):
+        """Return [(ordinal, hours)] of hours per day over window days
+
+        Average for every day in lo..hi is taken over window days
+        ending with it.
+        """
+        first, unpaid, paid = self.window(lo - window + 1, hi)
+        daily = numpy.zeros(hi - lo + window)
+        offset = first - (lo - window + 1)
+        daily[offset:offset + len(unpaid)] = unpaid + paid
+        sums = numpy.convolve(daily, numpy.ones(window), 'valid')
+        return list(zip(range(lo, hi + 1), (sums / window / 3600).tolist()))
+
+
+def engine_for(session_manager):
+    """Return fastest available engine for session_manager"""
+    if numpy is not None:
+        return NumpyEngine(session_manager)
+    return PythonEngine(session_manager)
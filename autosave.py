@@ -0,0 +1,76 @@
+import threading
+import time
+import helper_methods
+
+
+class AutoSaver(object):
+    """Background thread saving changes once they settle
+
+    Every change calls touch. Save runs in the thread after no
+    change came for delay seconds, so burst of changes is written
+    once, but never later than max_delay seconds after the first
+    unsaved change. Caller never waits for the save itself.
+    """
+
+    def __init__(self, save, delay=1.0, max_delay=10.0):
+        """Initialize autosaver
+
+        Params:
+            * save -> callable -> Writes unsaved changes
+            * delay -> float -> Seconds without changes before save
+            * max_delay -> float -> Longest time change stays unsaved
+        """
+        self.save = save
+        self.delay = delay
+        self.max_delay = max_delay
+        self.condition = threading.Condition()
+        # monotonic times of first and last unsaved change
+        self.first_change = None
+        self.last_change = None
+        self.stopping = False
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def touch(self, now=False):
+        """Register change, with now save as soon as possible"""
+        with self.condition:
+            changed = time.monotonic()
+            if now:
+                # due already, skip the debounce
+                changed -= self.max_delay
+            if self.first_change is None:
+                self.first_change = changed
+            self.last_change = changed
+            self.condition.notify()
+
+    def due_in(self):
+        """Seconds until pending save is due"""
+        return min(self.last_change + self.delay,
+                   self.first_change + self.max_delay) - time.monotonic()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.first_change is None and not self.stopping:
+                    self.condition.wait()
+                if self.first_change is None:
+                    return
+                while not self.stopping and self.due_in() > 0:
+                    self.condition.wait(self.due_in())
+                self.first_change = self.last_change = None
+            try:
+                self.save()
+            except Exception as e:
+                helper_methods.log(0, "Autosave failed: %s" % e)
+
+    def stop(self):
+        """Save pending changes and stop the thread"""
+        with self.condition:
+            self.stopping = True
+            self.condition.notify()
+        if self.thread.is_alive():
+            self.thread.join()
+        else:
+            self.save()
@@ -0,0 +1,213 @@
+"""Run commands on many session files without prompting
+
+Usage:
+    python batch.py --password-env WTM_PASSWORD --users alice bob \\
+        --script nightly.txt
+    python batch.py --key-file keys.txt < commands.txt
+
+Commands come from --script file, or from stdin. Line
+"open NAME [HOURLY_PRICE CURRENCY]" opens session_files/NAME (price
+and currency are needed only to create it), and commands after it
+run on that file until next open. With --users whole script runs
+for each of the users, without open lines. Every file is loaded
+once, and all its changes are saved once, when it is closed.
+
+Passwords come from one of:
+    --password-env VAR -> environment variable with password of
+    every file
+    --key-file FILE -> lines "name:password", name * is used for
+    files without their own line
+    --password-fd N -> like key file, read from file descriptor N
+"""
+import argparse
+import os
+import sys
+
+from commands import CommandProcessor
+import helper_methods
+import work_manager
+from work_manager import WorkManager
+
+
+class Credentials(object):
+    """Passwords of session files by their name"""
+
+    def __init__(self, passwords):
+        """Initialize credentials
+
+        Params:
+            * passwords -> dict -> name -> password, name * is
+            used for names not in dict
+        """
+        self.passwords = passwords
+
+    @staticmethod
+    def parse(lines):
+        """Return Credentials from "name:password" lines"""
+        passwords = {}
+        for line in lines:
+            line = line.rstrip("\r\n")
+            if not line or line.startswith("#"):
+                continue
+            name, separator, password = line.partition(":")
+            if not separator:
+                raise ValueError("Key line must be in name:password format")
+            passwords[name] = password
+        return Credentials(passwords)
+
+    @staticmethod
+    def from_env(variable):
+        if variable not in os.environ:
+            raise ValueError("Environment variable %s is not set" % variable)
+        return Credentials({"*": os.environ[variable]})
+
+    @staticmethod
+    def from_file(file_name):
+        with open(file_name) as key_file:
+            return Credentials.parse(key_file)
+
+    @staticmethod
+    def from_fd(fd):
+        with os.fdopen(fd) as key_file:
+            return Credentials.parse(key_file)
+
+    def password_for(self, name):
+        password = self.passwords.get(name, self.passwords.get("*"))
+        if password is None:
+            raise ValueError("No password for %s" % name)
+        return password
+
+
+class Batch(object):
+    """Runs command stream, one session file at a time"""
+
+    def __init__(self, credentials):
+        self.credentials = credentials
+        self.manager = None
+        self.processor = None
+        self.failed = 0
+
+    def open(self, name, hourly_price=None, currency=None):
+        """Close current file and open session file name"""
+        self.close()
+        ses_file = work_manager.sessions_storage.format(filename=name)
+        if not os.path.exists(ses_file) and (hourly_price is None or
+                                             currency is None):
+            raise ValueError("Session file %s doesn't exist, give hourly "
+                             "price and currency to create it" % name)
+        print("== %s ==" % name)
+        self.manager = WorkManager(ses_file,
+                                   self.credentials.password_for(name),
+                                   hourly_price, currency, autosave=False)
+        self.processor = CommandProcessor([self.manager])
+
+    def close(self):
+        """Save and close current file"""
+        if self.manager is not None:
+            manager, self.manager = self.manager, None
+            manager.close()
+
+    def fail(self, number, line, error):
+        helper_methods.log(0, "Line %s (%s) failed: %s" %
+                           (number, line, error))
+        self.failed += 1
+
+    def run(self, lines, first=1):
+        """Run commands from lines, return number of failed ones
+
+        Params:
+            * lines -> iterable -> Command lines
+            * first -> int -> Number of first line, for errors
+
+        Commands after file that failed to open are skipped.
+        """
+        skipping = False
+        try:
+            for number, line in enumerate(lines, first):
+                line = line.strip()
+                if not line or line.startswith("#"):
+                    continue
+                if line == "exit":
+                    break
+                parts = line.split(" ")
+                if parts[0] == "open":
+                    skipping = True
+                    try:
+                        self.open(*parts[1:])
+                        skipping = False
+                    except (ValueError, IOError, TypeError) as e:
+                        self.manager = None
+                        self.fail(number, line, e)
+                    continue
+                if skipping:
+                    continue
+                if self.manager is None:
+                    self.fail(number, line, "No session file is open")
+                    continue
+                try:
+                    if not self.processor.call(line):
+                        self.fail(number, line, "The command doesn't exist")
+                except Exception as e:
+                    self.fail(number, line, e)
+        finally:
+            self.close()
+        return self.failed
+
+
+def add_credentials_arguments(parser):
+    """Add password source options to argparse parser"""
+    passwords = parser.add_mutually_exclusive_group(required=True)
+    passwords.add_argument("--password-env", metavar="VAR",
+                           help="environment variable with password")
+    passwords.add_argument("--key-file", metavar="FILE",
+                           help="file with name:password lines")
+    passwords.add_argument("--password-fd", metavar="N", type=int,
+                           help="file descriptor with name:password lines")
+
+
+def credentials_from_arguments(args):
+    """Return Credentials from parsed password source options
+
+    Exits with status 2 if they can't be read.
+    """
+    try:
+        if args.password_env is not None:
+            return Credentials.from_env(args.password_env)
+        elif args.key_file is not None:
+            return Credentials.from_file(args.key_file)
+        else:
+            return Credentials.from_fd(args.password_fd)
+    except (ValueError, IOError, OSError) as e:
+        print(e)
+        sys.exit(2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    add_credentials_arguments(parser)
+    parser.add_argument("--script", metavar="FILE",
+                        help="command file, stdin if not supplied")
+    parser.add_argument("--users", nargs="+", metavar="NAME",
+                        help="run script for each of these session files")
+    work_manager.add_logging_arguments(parser)
+    args = parser.parse_args()
+    work_manager.setup_logging_from_arguments(args)
+    credentials = credentials_from_arguments(args)
+
+    if args.script is None:
+        lines = sys.stdin.readlines()
+    else:
+        with open(args.script) as script:
+            lines = script.readlines()
+    batch = Batch(credentials)
+    if args.users:
+        for name in args.users:
+            # script starts after added open line
+            batch.run(["open " + name] + lines, first=0)
+    else:
+        batch.run(lines)
+    sys.exit(1 if batch.failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,323 @@
+"""Benchmarks for SessionManager, crypto and load/save paths
+
+Usage:
+    python benchmark.py --sizes 1000 100000 1000000
+    python benchmark.py --save-baseline baseline.json
+    python benchmark.py --compare baseline.json --tolerance 0.25
+
+For every history size a synthetic history is generated and each
+benchmark reports throughput, latency percentiles and peak memory
+(measured with tracemalloc in separate run). With --compare, median
+latencies are checked against baseline and exit status is 1 if any
+benchmark got slower than tolerance allows.
+"""
+import argparse
+import contextlib
+from datetime import date, datetime, timedelta
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from codec import BinaryCodec
+from crypto import MyCrypto, SegmentedFile
+import helper_methods
+import timeformat
+import work_manager
+from work_manager import SessionManager, WorkManager
+
+session_format = timeformat.datetime_format.replace(" ", "-")
+
+
+def generate_rows(count, years, seed=0):
+    """Return count random (start_ts, end_ts, paid) rows over years"""
+    rng = random.Random(seed)
+    first = helper_methods.to_epoch(datetime(date.today().year - years, 1, 1))
+    span = years * 365 * 86400
+    rows = []
+    for i in range(count):
+        start = first + rng.randrange(span)
+        rows.append((start, start + rng.randrange(600, 36000),
+                     rng.random() < 0.5))
+    return rows
+
+
+def random_date_str(rng, years):
+    day = date.today() - timedelta(days=rng.randrange(years * 365))
+    return day.strftime(timeformat.date_format)
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+class Benchmark(object):
+    """Times one operation over a prepared history
+
+    Params:
+        * name -> string -> Benchmark name
+        * setup -> callable -> Takes context dict, returns
+        callable that runs the operation once
+        * repeat -> int -> Number of timed runs
+        * units -> callable -> Takes context, returns units
+        processed per run (sessions, bytes...) for throughput
+        * unit -> string -> Name of throughput unit
+    """
+
+    def __init__(self, name, setup, repeat=20, units=None, unit="ops"):
+        self.name = name
+        self.setup = setup
+        self.repeat = repeat
+        self.units = units
+        self.unit = unit
+
+    def run(self, context):
+        """Return dict with results of benchmark"""
+        operation = self.setup(context)
+        latencies = []
+        with open(os.devnull, 'w') as sink:
+            with contextlib.redirect_stdout(sink):
+                # warm up caches (derived keys, lazy months...)
+                operation()
+                for i in range(self.repeat):
+                    started = time.perf_counter()
+                    operation()
+                    latencies.append(time.perf_counter() - started)
+                operation = self.setup(context)
+                tracemalloc.start()
+                operation()
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+        units = self.units(context) if self.units else 1
+        return {
+            "p50": percentile(latencies, 0.5),
+            "p95": percentile(latencies, 0.95),
+            "p99": percentile(latencies, 0.99),
+            "throughput": units / (sum(latencies) / len(latencies)),
+            "unit": self.unit + "/s",
+            "peak_memory": peak
+        }
+
+
+def setup_calc_range(context):
+    rng = random.Random(1)
+    manager = context["manager"]
+
+    def operation():
+        d1 = random_date_str(rng, context["years"])
+        d2 = (datetime.strptime(d1, timeformat.date_format) +
+              timedelta(days=31)).strftime(timeformat.date_format)
+        manager.calculate_price(10.0, d1, d2)
+    return operation
+
+
+def setup_ps_range(context):
+    rng = random.Random(2)
+    manager = context["manager"]
+
+    def operation():
+        d1 = random_date_str(rng, context["years"])
+        d2 = (datetime.strptime(d1, timeformat.date_format) +
+              timedelta(days=31)).strftime(timeformat.date_format)
+        manager.print_sessions(d1, d2)
+    return operation
+
+
+def setup_mark_paid(context):
+    rng = random.Random(3)
+    manager = context["manager"]
+
+    def operation():
+        d1 = random_date_str(rng, context["years"])
+        d2 = (datetime.strptime(d1, timeformat.date_format) +
+              timedelta(days=31)).strftime(timeformat.date_format)
+        manager.mark_paid(d1, d2)
+        manager.mark_unpaid(d1, d2)
+    return operation
+
+
+def setup_add_session(context):
+    rng = random.Random(4)
+    manager = context["manager"]
+    rows = context["rows"]
+
+    def operation():
+        # half of the adds are duplicates of existing sessions
+        if rng.random() < 0.5:
+            start, end, paid = rows[rng.randrange(len(rows))]
+        else:
+            start, end, paid = generate_rows(1, context["years"],
+                                             rng.random())[0]
+        manager.add_session(
+            helper_methods.from_epoch(start).strftime(session_format),
+            helper_methods.from_epoch(end).strftime(session_format),
+            "true" if paid else "false")
+    return operation
+
+
+def setup_histogram(context):
+    rng = random.Random(5)
+    manager = context["manager"]
+
+    def operation():
+        lo = SessionManager.parse_date(random_date_str(rng, context["years"]))
+        manager.analytics().histogram(rng.choice(("day", "week", "month")),
+                                      lo, lo + 365)
+    return operation
+
+
+def setup_crypto_write(context):
+    segments = context["segments"]
+    path = os.path.join(context["directory"], "crypto_write")
+
+    def operation():
+        MyCrypto.write_segments(segments, path, context["keyring"])
+    return operation
+
+
+def setup_crypto_read(context):
+    path = os.path.join(context["directory"], "crypto_read")
+    if not os.path.exists(path):
+        MyCrypto.write_segments(context["segments"], path,
+                                context["keyring"])
+
+    def operation():
+        snapshot = SegmentedFile(path, context["keyring"])
+        for name in snapshot.names():
+            snapshot.read_segment(name)
+        snapshot.close()
+    return operation
+
+
+def setup_load(context):
+    manager = context.get("load_manager")
+    if manager is None:
+        path = os.path.join(context["directory"], "session_file")
+        manager = WorkManager(path, "bench", 10.0, "EUR", autosave=False)
+        manager.session_manager = SessionManager().from_columns(
+            context["rows"])
+        manager.session_manager.journal = manager.journal
+        manager.compact()
+        # the same manager is reloaded, so key is derived only once
+        # and runs measure decryption and decoding
+        context["load_manager"] = manager
+
+    def operation():
+        # load file and materialize whole history
+        manager.load()
+        manager.session_manager.calc_all(10.0)
+    return operation
+
+
+def content_size(context):
+    return sum(len(piece) for name, pieces in context["segments"]
+               for piece in pieces)
+
+
+benchmarks = [
+    Benchmark("calc_range", setup_calc_range, repeat=200),
+    Benchmark("ps_range", setup_ps_range, repeat=50),
+    Benchmark("mark_paid", setup_mark_paid, repeat=50),
+    Benchmark("add_session", setup_add_session, repeat=200),
+    Benchmark("histogram", setup_histogram, repeat=200),
+    Benchmark("crypto_write", setup_crypto_write, repeat=5,
+              units=content_size, unit="bytes"),
+    Benchmark("crypto_read", setup_crypto_read, repeat=5,
+              units=content_size, unit="bytes"),
+    Benchmark("load", setup_load, repeat=3,
+              units=lambda context: len(context["rows"]), unit="sessions"),
+]
+
+
+def make_context(size, years, directory):
+    """Generate history of size sessions and everything benchmarks use"""
+    rows = generate_rows(size, years)
+    manager = SessionManager().from_columns(rows)
+    context = {
+        "rows": rows,
+        "years": years,
+        "manager": manager,
+        "directory": directory,
+        "keyring": MyCrypto.keyring("bench"),
+    }
+    context["segments"] = [(name, BinaryCodec.encode_rows(rows))
+                           for name, rows in manager.month_rows()]
+    return context
+
+
+def run(sizes, years, names):
+    """Run benchmarks, return {benchmark: {size: results}}"""
+    results = {}
+    for size in sizes:
+        directory = tempfile.mkdtemp(prefix="wtm-bench-")
+        context = {}
+        try:
+            context = make_context(size, years, directory)
+            for benchmark in benchmarks:
+                if names and benchmark.name not in names:
+                    continue
+                result = benchmark.run(context)
+                results.setdefault(benchmark.name, {})[str(size)] = result
+                print("{:<14} {:>9} p50 {:>10.3f}ms p95 {:>10.3f}ms "
+                      "p99 {:>10.3f}ms {:>14.1f} {:<12} peak {:>8.1f}KiB"
+                      .format(benchmark.name, size, result["p50"] * 1000,
+                              result["p95"] * 1000, result["p99"] * 1000,
+                              result["throughput"], result["unit"],
+                              result["peak_memory"] / 1024))
+        finally:
+            if "load_manager" in context:
+                context["load_manager"].close()
+            shutil.rmtree(directory)
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Print benchmarks slower than baseline, return their count"""
+    regressions = 0
+    for name, sizes in sorted(results.items()):
+        for size, result in sorted(sizes.items()):
+            old = baseline.get(name, {}).get(size)
+            if old is None:
+                continue
+            ratio = result["p50"] / old["p50"]
+            if ratio > 1 + tolerance:
+                regressions += 1
+                print("REGRESSION {} {}: p50 {:.3f}ms -> {:.3f}ms "
+                      "({:+.0%})".format(name, size, old["p50"] * 1000,
+                                         result["p50"] * 1000, ratio - 1))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000],
+                        help="history sizes in sessions")
+    parser.add_argument("--years", type=int, default=10,
+                        help="years history is spread over")
+    parser.add_argument("--only", nargs="+", default=None,
+                        help="run only these benchmarks")
+    parser.add_argument("--save-baseline", metavar="FILE",
+                        help="store results as baseline")
+    parser.add_argument("--compare", metavar="FILE",
+                        help="compare results with baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="allowed slowdown against baseline")
+    args = parser.parse_args()
+
+    results = run(args.sizes, args.years, args.only)
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as output:
+            json.dump(results, output, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as baseline:
+            if compare(results, json.load(baseline), args.tolerance):
+                sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+from array import array
+import json
+import struct
+import sys
+
+# Codecs turn WorkManager state into bytes and back. Name of the
+# codec used is stored in the session file header ("codec" field),
+# files without it are json.
+#
+# Session files are segmented, json meta in its own segment and
+# sessions of each month in segment encoded with encode_rows.
+# Files written before that hold whole state, decode loads them
+# through these WorkManager methods:
+#   deserialize(dct) -> whole state from json-able dict
+#   restore(meta, rows) -> rebuild state from meta and rows
+
+# marks end of unfinished session in binary codec
+UNFINISHED = -(2 ** 63)
+
+
+class JsonCodec(object):
+    """Original json document format"""
+
+    name = "json"
+
+    @staticmethod
+    def decode(data, work_manager):
+        """Load state from encoded bytes into work_manager"""
+        work_manager.deserialize(json.loads(data))
+
+    @staticmethod
+    def encode_rows(rows):
+        """Return list of bytes pieces with (start, end, paid) rows"""
+        return [json.dumps([list(row) for row in rows]).encode('utf-8')]
+
+    @staticmethod
+    def decode_rows(data):
+        """Return (start, end, paid) rows from encode_rows bytes"""
+        return [tuple(row) for row in json.loads(data)]
+
+
+class BinaryCodec(object):
+    """Compact binary format
+
+    Layout (little endian):
+        meta length (I) | session count (Q) | meta (json)
+        start epoch seconds (q) * count
+        end epoch seconds (q) * count, UNFINISHED if running
+        paid bitmap, bit i of byte i // 8 is set if session i is paid
+    """
+
+    name = "binary"
+    head = struct.Struct("<IQ")
+    count = struct.Struct("<Q")
+
+    @staticmethod
+    def to_little(values):
+        if sys.byteorder != "little":
+            values.byteswap()
+        return values
+
+    @staticmethod
+    def pack_rows(rows):
+        """Return (count, pieces) with arrays and bitmap of rows"""
+        starts, ends = array('q'), array('q')
+        paid = bytearray()
+        for i, (start, end, is_paid) in enumerate(rows):
+            starts.append(start)
+            ends.append(UNFINISHED if end is None else end)
+            if i % 8 == 0:
+                paid.append(0)
+            if is_paid:
+                paid[-1] |= 1 << (i % 8)
+        return len(starts), [BinaryCodec.to_little(starts).tobytes(),
+                             BinaryCodec.to_little(ends).tobytes(),
+                             bytes(paid)]
+
+    @staticmethod
+    def unpack_rows(view, offset, count):
+        """Return rows packed by pack_rows at offset of view"""
+        starts, ends = array('q'), array('q')
+        starts.frombytes(view[offset:offset + 8 * count])
+        offset += 8 * count
+        ends.frombytes(view[offset:offset + 8 * count])
+        offset += 8 * count
+        paid = view[offset:offset + (count + 7) // 8]
+        BinaryCodec.to_little(starts)
+        BinaryCodec.to_little(ends)
+        return ((starts[i],
+                 None if ends[i] == UNFINISHED else ends[i],
+                 bool(paid[i >> 3] & (1 << (i & 7))))
+                for i in range(count))
+
+    @staticmethod
+    def decode(data, work_manager):
+        """Load state from encoded bytes into work_manager"""
+        view = memoryview(data)
+        meta_length, count = BinaryCodec.head.unpack_from(view)
+        offset = BinaryCodec.head.size
+        meta = json.loads(bytes(view[offset:offset + meta_length]))
+        offset += meta_length
+        work_manager.restore(meta, BinaryCodec.unpack_rows(view, offset,
+                                                           count))
+
+    @staticmethod
+    def encode_rows(rows):
+        """Return list of bytes pieces with (start, end, paid) rows"""
+        count, pieces = BinaryCodec.pack_rows(rows)
+        return [BinaryCodec.count.pack(count)] + pieces
+
+    @staticmethod
+    def decode_rows(data):
+        """Return (start, end, paid) rows from encode_rows bytes"""
+        view = memoryview(data)
+        count, = BinaryCodec.count.unpack_from(view)
+        return BinaryCodec.unpack_rows(view, BinaryCodec.count.size, count)
+
+
+codecs = {codec.name: codec for codec in (JsonCodec, BinaryCodec)}
+
+
+def get_codec(name):
+    """Return codec by name, json if name is None"""
+    if name is None:
+        return JsonCodec
+    if name not in codecs:
+        raise ValueError("Unsupported codec %s" % name)
+    return codecs[name]
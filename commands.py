@@ -1,4 +1,5 @@
 import helper_methods
+from stats import stats
 
 
 class CommandProcessor(object):
@@ -8,12 +9,12 @@ class CommandProcessor(object):
     interpretation and will call right
     method to handle it.
 
-    If you add a method to the class that
-    can handle some user command, then register
-    it here. Your method must be in format
-    cmd_[method_name]. You can't duplicate methods
-    because  it will create confusion. After you
-    register your method, do so in the doc
+    If you add a method to any of the handlers
+    that can handle some user command, name it
+    cmd_[command_name] and it will be found
+    automatically. If more handlers have the same
+    method, the first one in the list is used.
+    After you add your method, document it in the doc
     """
 
     def __init__(self, method_handlers):
@@ -23,23 +24,19 @@ class CommandProcessor(object):
             * method_handlers -> list -> Objects that may
         contain appropriate methods.
 
+        Handlers are looked up once here, into dispatch dict
+        of command name -> bound method.
         """
         self.method_handlers = method_handlers
-        self.cmds = [
-            "save",
-            "ttime",
-            "start",
-            "change_h_price",
-            "mark_paid",
-            "mark_unpaid",
-            "add_session",
-            "print_sessions",
-            "remove_sessions",
-            "stop",
-            "load",
-            "calc",
-            "ims"
-        ]
+        self.dispatch = {}
+        for potential_handler in method_handlers:
+            for attribute in dir(potential_handler):
+                if not attribute.startswith("cmd_"):
+                    continue
+                funct = getattr(potential_handler, attribute)
+                if callable(funct):
+                    self.dispatch.setdefault(attribute[len("cmd_"):], funct)
+        self.cmds = sorted(self.dispatch)
 
     def call(self, user_input):
         """Call appropriate method
@@ -50,20 +47,45 @@ class CommandProcessor(object):
         Split user command into parts, find
         appropriate method to call from parts[0],
         and call it with arguments parts[1:]
+        Return if command exists.
         """
         cmd_parts = user_input.split(" ")
         cmd = cmd_parts[0]
         arguments = [] if len(cmd_parts) == 1 else cmd_parts[1:]
-        if cmd.strip().lower() in self.cmds:
-            for potential_handler in self.method_handlers:
-                funct = getattr(
-                    potential_handler,
-                    "cmd_{command}".format(command=cmd),
-                    None  # default if attr not existent
-                )
-                if funct is not None:
-                    funct(arguments)
-                    return
-            helper_methods.log(1, "Command registered but unexistent")
-        else:
+        name = cmd.strip().lower()
+        funct = self.dispatch.get(name)
+        if funct is None:
             helper_methods.log(3, "The command doesn't exist")
+            return False
+        with stats.timer("command." + name):
+            funct(arguments)
+        return True
+
+    def run_script(self, lines):
+        """Call commands from lines, without prompting
+
+        Params:
+            * lines -> iterable -> One command per line
+
+        Empty lines and lines starting with # are skipped, exit
+        ends the script. Command that fails or doesn't exist is
+        logged with its line number and the script goes on.
+        Return number of failed commands.
+        """
+        failed = 0
+        for number, line in enumerate(lines, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            if line == "exit":
+                break
+            try:
+                if not self.call(line):
+                    helper_methods.log(0, "Line %s (%s) failed: The command "
+                                       "doesn't exist" % (number, line))
+                    failed += 1
+            except Exception as e:
+                helper_methods.log(0, "Line %s (%s) failed: %s" %
+                                   (number, line, e))
+                failed += 1
+        return failed
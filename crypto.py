@@ -1,5 +1,112 @@
+import json
+import mmap
+import os
+import struct
+import threading
 from Crypto.Cipher import AES
 from Crypto.Hash import SHA256
+from Crypto.Protocol.KDF import PBKDF2, scrypt
+from Crypto.Random import get_random_bytes
+from stats import stats
+
+# File layout (version 1):
+#   MAGIC | version (B) | header length (H) | header (json)
+#   chunk*: length (I) | last (B) | nonce (16) | tag (16) | ciphertext
+# Every chunk is authenticated together with the whole header, its
+# index and a flag telling if it is the last one, so chunks can't be
+# reordered, moved between files or cut off from the end.
+# Header json has "kdf" with KDF name, its parameters and hex salt
+# (files without it use bare SHA-256 of the password).
+# Segmented files (header "segmented": true) group chunks into named
+# segments which can be decrypted independently. Chunk indexes run
+# through the whole file and only the very last chunk has last flag.
+# After the last chunk comes trailer with offset and first chunk
+# index of the final segment, which is json index of all segments:
+#   {name: [offset, first chunk index, chunk count]}
+# Files that don't start with MAGIC are legacy (version 0) files:
+#   nonce (16) | tag (16) | ciphertext of the whole content
+MAGIC = b"WTMCRYPT"
+FORMAT_VERSION = 1
+CHUNK_SIZE = 64 * 1024
+
+PREFIX = struct.Struct(">8sBH")
+CHUNK_HEAD = struct.Struct(">IB16s16s")
+CHUNK_AAD = struct.Struct(">QB")
+TRAILER = struct.Struct(">QQ")
+
+# KDF used for new files, see KeyRing.derive for supported ones
+DEFAULT_KDF = {"name": "scrypt", "n": 2 ** 15, "r": 8, "p": 1}
+SALT_SIZE = 16
+
+
+class KeyRing(object):
+    """Password with cache of keys derived from it
+
+    Deriving key with proper KDF is slow on purpose, so
+    derived keys are cached by KDF parameters and salt, and
+    every file written with the same KeyRing reuses its salt.
+    One KeyRing should live as long as its password is used,
+    and be cleared when it is not needed anymore.
+    """
+
+    def __init__(self, password, kdf=None):
+        """Initialize key ring
+
+        Params:
+            * password -> string -> Password keys are derived from
+            * kdf -> dict -> KDF parameters for new files,
+            DEFAULT_KDF if not supplied
+        """
+        self.password = password
+        self.kdf = dict(kdf or DEFAULT_KDF)
+        self.salt = None
+        self.keys = {}
+
+    @staticmethod
+    def derive(password, kdf, salt):
+        """Derive 256 bit key from password with kdf parameters"""
+        secret = password.encode('utf-8')
+        if kdf["name"] == "scrypt":
+            return scrypt(secret, salt, 32, N=kdf["n"], r=kdf["r"],
+                          p=kdf["p"])
+        elif kdf["name"] == "pbkdf2":
+            return PBKDF2(secret, salt, 32, count=kdf["iterations"],
+                          hmac_hash_module=SHA256)
+        raise ValueError("Unsupported KDF %s" % kdf["name"])
+
+    def new_file_kdf(self):
+        """Return "kdf" header field for a new file"""
+        if self.salt is None:
+            self.salt = get_random_bytes(SALT_SIZE)
+        return dict(self.kdf, salt=self.salt.hex())
+
+    def key_for(self, fields):
+        """Return key for file with header fields"""
+        kdf = fields.get("kdf")
+        if kdf is None:
+            cache_key = "sha256"
+        else:
+            cache_key = json.dumps(kdf, sort_keys=True)
+        if self.password is None:
+            raise ValueError("Key ring was cleared")
+        if cache_key not in self.keys:
+            if kdf is None:
+                key = MyCrypto.password_to_key(self.password)
+            else:
+                with stats.timer("crypto.kdf"):
+                    key = self.derive(self.password, kdf,
+                                      bytes.fromhex(kdf["salt"]))
+            self.keys[cache_key] = key
+        if kdf is not None and self.salt is None:
+            # keep writing with salt of the file we read
+            self.salt = bytes.fromhex(kdf["salt"])
+        return self.keys[cache_key]
+
+    def clear(self):
+        """Forget password and all derived keys"""
+        self.password = None
+        self.keys.clear()
+
 
 class MyCrypto(object):
     @staticmethod
@@ -11,40 +118,371 @@ class MyCrypto(object):
         return SHA256.new(password.encode('utf-8')).digest()
 
     @staticmethod
-    def write_to_file(content, file_name, password):
-        """Write password encrypted content to the file.
+    def keyring(password):
+        """Return KeyRing for password, which may already be one"""
+        if isinstance(password, KeyRing):
+            return password
+        return KeyRing(password)
+
+    @staticmethod
+    def make_header(keyring, chunk_size=CHUNK_SIZE, extra=None):
+        """Build header for a new file
 
         Params:
-            * content -> string -> content to be encrypted
+            * keyring -> KeyRing -> Key ring to encrypt file with
+            * chunk_size -> int -> plaintext bytes per chunk
+            * extra -> dict -> Additional header fields
+
+        Return (header_bytes, key) tuple.
+        """
+        fields = dict(extra or {})
+        fields.update({
+            "chunk_size": chunk_size,
+            "file_id": get_random_bytes(16).hex(),
+            "kdf": keyring.new_file_kdf()
+        })
+        body = json.dumps(fields, sort_keys=True).encode('utf-8')
+        header = PREFIX.pack(MAGIC, FORMAT_VERSION, len(body)) + body
+        return header, keyring.key_for(fields)
+
+    @staticmethod
+    def read_header(file_object):
+        """Read header from file object
+
+        Return (version, header_bytes, header_dict). For legacy
+        files version is 0, header is empty and file object is
+        rewinded to the beginning.
+        """
+        prefix = file_object.read(PREFIX.size)
+        if len(prefix) == PREFIX.size and prefix.startswith(MAGIC):
+            magic, version, length = PREFIX.unpack(prefix)
+            if version != FORMAT_VERSION:
+                raise ValueError("Unsupported file version %s" % version)
+            body = file_object.read(length)
+            return version, prefix + body, json.loads(body.decode('utf-8'))
+        file_object.seek(0)
+        return 0, b"", {}
+
+    @staticmethod
+    def rechunk(pieces, chunk_size):
+        """Regroup byte pieces into chunk_size blocks
+
+        Yield (block, is_last) tuples, there is always at
+        least one (possibly empty) block.
+        """
+        buffer = bytearray()
+        pending = None
+        for piece in pieces:
+            buffer += piece
+            while len(buffer) > chunk_size:
+                if pending is not None:
+                    yield pending, False
+                pending = bytes(buffer[:chunk_size])
+                del buffer[:chunk_size]
+        if pending is not None:
+            if buffer:
+                yield pending, False
+            else:
+                yield pending, True
+                return
+        yield bytes(buffer), True
+
+    @staticmethod
+    def seal_record(block, key, header, index, is_last):
+        """Encrypt one block into on-disk chunk record bytes"""
+        with stats.timer("crypto.encrypt"):
+            cipher = AES.new(key, AES.MODE_EAX)
+            cipher.update(header + CHUNK_AAD.pack(index, is_last))
+            ciphertext, tag = cipher.encrypt_and_digest(block)
+        stats.count("crypto.encrypted_bytes", len(block))
+        return CHUNK_HEAD.pack(len(block), is_last, cipher.nonce,
+                               tag) + ciphertext
+
+    @staticmethod
+    def open_record(file_object, key, header, index):
+        """Read and decrypt one chunk record from file object
+
+        Return (plaintext, is_last) tuple, or None if file
+        object is at its end. Raise EOFError if record is cut
+        off, and ValueError if it isn't authentic.
+        """
+        head = file_object.read(CHUNK_HEAD.size)
+        if not head:
+            return None
+        if len(head) < CHUNK_HEAD.size:
+            raise EOFError("Record is truncated")
+        length, last, nonce, tag = CHUNK_HEAD.unpack(head)
+        ciphertext = file_object.read(length)
+        if len(ciphertext) < length:
+            raise EOFError("Record is truncated")
+        with stats.timer("crypto.decrypt"):
+            cipher = AES.new(key, AES.MODE_EAX, nonce)
+            cipher.update(header + CHUNK_AAD.pack(index, last))
+            plaintext = cipher.decrypt_and_verify(ciphertext, tag)
+        stats.count("crypto.decrypted_bytes", length)
+        return plaintext, bool(last)
+
+    @staticmethod
+    def encrypt_chunks(pieces, key, header, chunk_size):
+        """Encrypt byte pieces, yielding on-disk chunk records"""
+        blocks = MyCrypto.rechunk(pieces, chunk_size)
+        for index, (block, is_last) in enumerate(blocks):
+            yield MyCrypto.seal_record(block, key, header, index, is_last)
+
+    @staticmethod
+    def decrypt_chunks(file_object, key, header):
+        """Read chunk records from file object, yielding plaintext"""
+        index = 0
+        while True:
+            try:
+                record = MyCrypto.open_record(file_object, key, header,
+                                              index)
+            except EOFError:
+                record = None
+            if record is None:
+                raise ValueError("File is truncated")
+            plaintext, last = record
+            yield plaintext
+            if last:
+                if file_object.read(1):
+                    raise ValueError("Data after last chunk")
+                return
+            index += 1
+
+    @staticmethod
+    def decrypt_into(cipher, ciphertext, tag, output):
+        """Decrypt and verify ciphertext straight into output buffer"""
+        try:
+            cipher.decrypt_and_verify(ciphertext, tag, output=output)
+        except TypeError:
+            # pycryptodome without output parameter
+            output[:] = cipher.decrypt_and_verify(ciphertext, tag)
+
+    @staticmethod
+    def scan_records(view, offset, end, count=None):
+        """Return (records, offset after them) of chunk records in view
+
+        Records are (offset, length, last) tuples of count records,
+        or of records up to the one with last flag if count is None.
+        Nothing is decrypted, so plaintext buffer can be sized
+        first. Raise EOFError if record is cut off before end.
+        """
+        records = []
+        while count is None or len(records) < count:
+            if offset + CHUNK_HEAD.size > end:
+                raise EOFError("Record is truncated")
+            length, last = CHUNK_HEAD.unpack_from(view, offset)[:2]
+            if offset + CHUNK_HEAD.size + length > end:
+                raise EOFError("Record is truncated")
+            records.append((offset, length, last))
+            offset += CHUNK_HEAD.size + length
+            if count is None and last:
+                break
+        return records, offset
+
+    @staticmethod
+    def decrypt_records(view, records, key, header, first):
+        """Decrypt scanned records of view into one new bytearray
+
+        Params:
+            * view -> memoryview -> Mapped file
+            * records -> list -> From scan_records
+            * first -> int -> Chunk index of the first record
+        """
+        plaintext = bytearray(sum(record[1] for record in records))
+        output = memoryview(plaintext)
+        position = 0
+        for index, (offset, length, last) in enumerate(records, first):
+            nonce, tag = CHUNK_HEAD.unpack_from(view, offset)[2:]
+            start = offset + CHUNK_HEAD.size
+            with stats.timer("crypto.decrypt"):
+                cipher = AES.new(key, AES.MODE_EAX, nonce)
+                cipher.update(header + CHUNK_AAD.pack(index, last))
+                MyCrypto.decrypt_into(cipher, view[start:start + length], tag,
+                                      output[position:position + length])
+            stats.count("crypto.decrypted_bytes", length)
+            position += length
+        return plaintext
+
+    @staticmethod
+    def close_map(mapped):
+        """Close mmap, or leave it to garbage collector if it is in use
+
+        Views of it stay alive in traceback of failed decryption.
+        """
+        try:
+            mapped.close()
+        except BufferError:
+            pass
+
+    @staticmethod
+    def write_chunks(pieces, file_name, password, chunk_size=CHUNK_SIZE,
+                     extra=None, fsync=False):
+        """Stream byte pieces to password encrypted file
+
+        Params:
+            * pieces -> iterable -> bytes to be encrypted, of any size
             * file_name -> string -> file name to save
             encrypted content to
-            * password -> string -> password for encryption
+            * password -> string/KeyRing -> password for encryption
+            * chunk_size -> int -> plaintext bytes per chunk
+            * extra -> dict -> Additional header fields, eg. codec
+            * fsync -> boolean -> Force file to disk (see replace_file)
 
+        Content is written to temporary file which replaces
+        file_name only when it is complete, so a crash never
+        leaves half written file behind.
         """
+        header, key = MyCrypto.make_header(MyCrypto.keyring(password),
+                                           chunk_size, extra)
+        temp_name = file_name + ".tmp"
+        with open(temp_name, 'wb+') as output:
+            output.write(header)
+            for record in MyCrypto.encrypt_chunks(pieces, key, header,
+                                                  chunk_size):
+                output.write(record)
+            MyCrypto.sync_file(output, fsync)
+        MyCrypto.replace_file(temp_name, file_name, fsync)
 
-        with open(file_name, 'wb+') as output:
+    @staticmethod
+    def sync_file(file_object, fsync):
+        """Force written content of file_object to disk, if fsync"""
+        if fsync:
+            file_object.flush()
+            os.fsync(file_object.fileno())
+
+    @staticmethod
+    def replace_file(temp_name, file_name, fsync):
+        """Atomically move complete temp_name over file_name
+
+        With fsync the rename is forced to disk too, so file
+        survives power loss, not only crash of the program.
+        """
+        os.replace(temp_name, file_name)
+        if fsync and hasattr(os, "O_DIRECTORY"):
+            directory = os.open(os.path.dirname(file_name) or ".",
+                                os.O_RDONLY | os.O_DIRECTORY)
             try:
-                key = MyCrypto.password_to_key(password)
-                cipher = AES.new(key, AES.MODE_EAX)
-                ciphertext, tag = cipher.encrypt_and_digest(content.encode('utf-8'))
-                [ output.write(x) for x in (cipher.nonce, tag, ciphertext) ]
+                os.fsync(directory)
+            finally:
+                os.close(directory)
 
-            except ValueError as e:
-                print(e);
+    @staticmethod
+    def write_segments(segments, file_name, password, chunk_size=CHUNK_SIZE,
+                       extra=None, fsync=False, replace=True):
+        """Stream named segments to password encrypted segmented file
 
+        Params:
+            * segments -> iterable -> (name, pieces) tuples, pieces
+            is iterable of bytes of any size
+            * file_name -> string -> file name to save
+            encrypted content to
+            * password -> string/KeyRing -> password for encryption
+            * chunk_size -> int -> plaintext bytes per chunk
+            * extra -> dict -> Additional header fields, eg. codec
+            * fsync -> boolean -> Force file to disk (see replace_file)
+            * replace -> boolean -> If False, file_name is left as it
+            is and name of complete temp file is returned, caller
+            moves it with replace_file
+
+        File is replaced only when it is complete, like in
+        write_chunks.
+        """
+        extra = dict(extra or {}, segmented=True)
+        header, key = MyCrypto.make_header(MyCrypto.keyring(password),
+                                           chunk_size, extra)
+        temp_name = file_name + ".tmp"
+        index = {}
+        chunk = 0
+        written = 0
+        with open(temp_name, 'wb+') as output:
+            output.write(header)
+            for name, pieces in segments:
+                offset, first = output.tell(), chunk
+                for block, _ in MyCrypto.rechunk(pieces, chunk_size):
+                    output.write(MyCrypto.seal_record(block, key, header,
+                                                      chunk, False))
+                    written += len(block)
+                    chunk += 1
+                index[name] = [offset, first, chunk - first]
+            offset, first = output.tell(), chunk
+            blocks = MyCrypto.rechunk([json.dumps(index).encode('utf-8')],
+                                      chunk_size)
+            for block, is_last in blocks:
+                output.write(MyCrypto.seal_record(block, key, header, chunk,
+                                                  is_last))
+                chunk += 1
+            output.write(TRAILER.pack(offset, first))
+            MyCrypto.sync_file(output, fsync)
+        stats.count("crypto.written_file_bytes", written)
+        if not replace:
+            return temp_name
+        MyCrypto.replace_file(temp_name, file_name, fsync)
 
     @staticmethod
-    def read_from_file(file_name, password, is_string=True):
+    def read_chunks(file_name, password, fields_out=None):
+        """Stream decrypted plaintext chunks of file
+
+        Legacy single blob files are yielded as one chunk.
+        Raise ValueError if file is corrupt or password is wrong.
+        If fields_out dict is supplied, it is filled with header
+        fields before first chunk is yielded.
+        """
         with open(file_name, 'rb') as file_object:
-          nonce, tag, ciphertext = [ file_object.read(x) for x in (16, 16, -1) ]
-          key = MyCrypto.password_to_key(password)
-          cipher = AES.new(key, AES.MODE_EAX, nonce)
-          plaintext = cipher.decrypt_and_verify(ciphertext, tag)
-          print(plaintext)
-          if is_string:
-              return plaintext.decode('utf8')
-          else:
-              return plaintext
+            version, header, fields = MyCrypto.read_header(file_object)
+            if fields_out is not None:
+                fields_out.update(fields)
+            if fields.get("segmented", False):
+                raise ValueError("File is segmented, use SegmentedFile")
+            key = MyCrypto.keyring(password).key_for(fields)
+            if version == 0:
+                nonce, tag, ciphertext = [
+                    file_object.read(x) for x in (16, 16, -1)]
+                cipher = AES.new(key, AES.MODE_EAX, nonce)
+                yield cipher.decrypt_and_verify(ciphertext, tag)
+                return
+            for plaintext in MyCrypto.decrypt_chunks(file_object, key,
+                                                     header):
+                yield plaintext
+
+    @staticmethod
+    def read_with_header(file_name, password):
+        """Return (header_fields, plaintext bytearray) of file
+
+        File is memory mapped and decrypted straight into one
+        preallocated buffer, so the only copy of content in
+        memory is the returned plaintext.
+        Raise ValueError if file is corrupt or password is wrong.
+        """
+        with open(file_name, 'rb') as file_object:
+            version, header, fields = MyCrypto.read_header(file_object)
+            if fields.get("segmented", False):
+                raise ValueError("File is segmented, use SegmentedFile")
+            key = MyCrypto.keyring(password).key_for(fields)
+            start = file_object.tell()
+            mapped = mmap.mmap(file_object.fileno(), 0,
+                               access=mmap.ACCESS_READ)
+        try:
+            view = memoryview(mapped)
+            if version == 0:
+                if len(view) < 32:
+                    raise ValueError("File is truncated")
+                plaintext = bytearray(len(view) - 32)
+                MyCrypto.decrypt_into(AES.new(key, AES.MODE_EAX, view[:16]),
+                                      view[32:], view[16:32],
+                                      memoryview(plaintext))
+            else:
+                records, end = MyCrypto.scan_records(view, start, len(view))
+                if end != len(view):
+                    raise ValueError("Data after last chunk")
+                plaintext = MyCrypto.decrypt_records(view, records, key,
+                                                     header, 0)
+            del view
+        except EOFError:
+            raise ValueError("File is truncated")
+        finally:
+            MyCrypto.close_map(mapped)
+        return fields, plaintext
 
     @staticmethod
     def encrypt_text(text, password):
@@ -54,3 +492,81 @@ class MyCrypto(object):
     def decrypt_text(text, password):
         pass
 
+
+class SegmentedFile(object):
+    """Random access reader of segmented file
+
+    File stays open and memory mapped until close, so segments
+    can be read from the same snapshot even after file was
+    replaced by a new one. Segment is decrypted straight from
+    the map into one buffer. Reads are serialized with a lock,
+    so segments can be read from background threads too.
+    """
+
+    def __init__(self, file_name, password):
+        """Open file and read its segment index
+
+        Raise ValueError if file is corrupt or password is wrong.
+        is_segmented is False for files written without segments,
+        those have to be read whole with MyCrypto.read_chunks.
+        """
+        self.file_object = open(file_name, 'rb')
+        self.lock = threading.Lock()
+        self.index = {}
+        self.map = None
+        try:
+            version, self.header, self.fields = MyCrypto.read_header(
+                self.file_object)
+            self.is_segmented = self.fields.get("segmented", False)
+            if self.is_segmented:
+                self.key = MyCrypto.keyring(password).key_for(self.fields)
+                self.map = mmap.mmap(self.file_object.fileno(), 0,
+                                     access=mmap.ACCESS_READ)
+                self.end = len(self.map) - TRAILER.size
+                if self.end < 0:
+                    raise ValueError("File is truncated")
+                offset, first = TRAILER.unpack_from(self.map, self.end)
+                index = self.read_chunks(offset, first, None, self.end)
+                self.index = json.loads(index)
+        except (ValueError, EOFError, struct.error, OSError):
+            self.close()
+            raise ValueError("File is corrupt or password is incorrect")
+
+    def read_chunks(self, offset, first, count, end=None):
+        """Decrypt count chunks starting at offset
+
+        If count is None read until chunk with last flag, which
+        has to end at end offset.
+        """
+        with self.lock:
+            view = memoryview(self.map)
+            records, stop = MyCrypto.scan_records(
+                view, offset, self.end if end is None else end, count)
+            if count is None:
+                if stop != end:
+                    raise ValueError("Unexpected last chunk")
+            elif any(last for offset, length, last in records):
+                raise ValueError("Unexpected last chunk")
+            plaintext = MyCrypto.decrypt_records(view, records, self.key,
+                                                 self.header, first)
+            del view
+        return plaintext
+
+    def names(self):
+        """Return names of all segments"""
+        return list(self.index)
+
+    def read_segment(self, name):
+        """Return decrypted plaintext of named segment"""
+        try:
+            offset, first, count = self.index[name]
+            plaintext = self.read_chunks(offset, first, count)
+        except EOFError:
+            raise ValueError("File is truncated")
+        stats.count("crypto.read_file_bytes", len(plaintext))
+        return plaintext
+
+    def close(self):
+        if self.map is not None:
+            MyCrypto.close_map(self.map)
+        self.file_object.close()
@@ -0,0 +1,143 @@
+import csv
+import io
+import json
+import struct
+
+from codec import BinaryCodec
+from crypto import MyCrypto
+from timeformat import format_datetime
+
+# Export files hold finished sessions, one per row, streamed from
+# (start_ts, end_ts, paid) rows so memory use doesn't grow with
+# history. csv and json lines files use the format importer reads:
+#   start_time,end_time,paid
+#   {"start_time": "01/01/2026 10:00:00", "end_time": ..., "paid": false}
+# Columnar files are row groups of at most GROUP_ROWS rows:
+#   COLUMNAR_MAGIC | (group length (Q) | group)*
+# where group is BinaryCodec.encode_rows layout: count (Q), start
+# epoch seconds (q) * count, end epoch seconds (q) * count and paid
+# bitmap, all little endian.
+# Encrypted exports are MyCrypto chunked files of the same bytes.
+
+FORMATS = ("csv", "jsonl", "columnar")
+COLUMNAR_MAGIC = b"WTMCOLS1"
+GROUP_LENGTH = struct.Struct("<Q")
+# rows formatted together, and rows per columnar group
+BATCH_ROWS = 1024
+GROUP_ROWS = 64 * 1024
+
+
+def format_of(file_name):
+    """Return export format from file name extension"""
+    if file_name.endswith(".csv"):
+        return "csv"
+    if file_name.endswith((".jsonl", ".json")):
+        return "jsonl"
+    return "columnar"
+
+
+def batches(rows, size):
+    """Yield lists of at most size rows"""
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def csv_pieces(rows):
+    """Yield csv bytes of rows, header first"""
+    text = io.StringIO()
+    writer = csv.writer(text, lineterminator="\n")
+    writer.writerow(("start_time", "end_time", "paid"))
+    for batch in batches(rows, BATCH_ROWS):
+        writer.writerows(
+            (format_datetime(start), format_datetime(end),
+             "true" if paid else "false")
+            for start, end, paid in batch)
+        yield text.getvalue().encode('utf-8')
+        text.seek(0)
+        text.truncate()
+    if text.tell():
+        yield text.getvalue().encode('utf-8')
+
+
+def jsonl_pieces(rows):
+    """Yield json lines bytes of rows"""
+    for batch in batches(rows, BATCH_ROWS):
+        yield "".join(json.dumps({
+            "start_time": format_datetime(start),
+            "end_time": format_datetime(end),
+            "paid": bool(paid)
+        }) + "\n" for start, end, paid in batch).encode('utf-8')
+
+
+def columnar_pieces(rows):
+    """Yield columnar file bytes of rows"""
+    yield COLUMNAR_MAGIC
+    for batch in batches(rows, GROUP_ROWS):
+        pieces = BinaryCodec.encode_rows(batch)
+        yield GROUP_LENGTH.pack(sum(len(piece) for piece in pieces))
+        for piece in pieces:
+            yield piece
+
+
+writers = {"csv": csv_pieces, "jsonl": jsonl_pieces,
+           "columnar": columnar_pieces}
+
+
+def export(rows, file_name, file_format=None, password=None):
+    """Stream rows into export file, return number of rows written
+
+    Params:
+        * rows -> iterable -> (start_ts, end_ts, paid) of finished
+        sessions
+        * file_name -> string -> File to write
+        * file_format -> string -> One of FORMATS, from file name
+        extension if None
+        * password -> string/KeyRing -> Encrypt file with MyCrypto
+        if supplied
+    """
+    if file_format is None:
+        file_format = format_of(file_name)
+    if file_format not in writers:
+        raise ValueError("Export format must be one of %s" %
+                         ", ".join(FORMATS))
+    counted = [0]
+
+    def counting(rows):
+        for row in rows:
+            counted[0] += 1
+            yield row
+
+    pieces = writers[file_format](counting(rows))
+    if password is not None:
+        MyCrypto.write_chunks(pieces, file_name, password,
+                              extra={"export": file_format})
+    else:
+        temp_name = file_name + ".tmp"
+        with open(temp_name, "wb") as output:
+            for piece in pieces:
+                output.write(piece)
+        MyCrypto.replace_file(temp_name, file_name, False)
+    return counted[0]
+
+
+def read_columnar(file_name):
+    """Stream (start_ts, end_ts, paid) rows of unencrypted columnar file"""
+    with open(file_name, "rb") as input_file:
+        if input_file.read(len(COLUMNAR_MAGIC)) != COLUMNAR_MAGIC:
+            raise ValueError("File is not a columnar export")
+        while True:
+            head = input_file.read(GROUP_LENGTH.size)
+            if not head:
+                return
+            length, = GROUP_LENGTH.unpack(head)
+            group = input_file.read(length)
+            if len(head) < GROUP_LENGTH.size or len(group) < length:
+                raise ValueError("File is truncated")
+            for row in BinaryCodec.decode_rows(group):
+                yield row
@@ -0,0 +1,55 @@
+import os
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows
+    fcntl = None
+    import msvcrt
+
+
+class FileLock(object):
+    """Exclusive lock between processes using the same session file
+
+    Lock is held on separate lock file, so the session file itself
+    can still be replaced atomically while it is locked. OS drops
+    the lock when process dies, so there are no stale locks.
+    """
+
+    def __init__(self, file_name):
+        """Initialize lock
+
+        Params:
+            * file_name -> string -> Path of the lock file
+        """
+        self.file_name = file_name
+        self.file_object = None
+
+    def acquire(self):
+        """Take the lock, raise IOError if someone else holds it"""
+        if self.file_object is not None:
+            return
+        file_object = open(self.file_name, 'a+')
+        try:
+            if fcntl is not None:
+                fcntl.flock(file_object.fileno(),
+                            fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                file_object.seek(0)
+                msvcrt.locking(file_object.fileno(), msvcrt.LK_NBLCK, 1)
+        except (IOError, OSError):
+            file_object.close()
+            raise IOError("%s is opened by another process" %
+                          os.path.splitext(self.file_name)[0])
+        self.file_object = file_object
+
+    def release(self):
+        """Release the lock if it is held"""
+        if self.file_object is None:
+            return
+        if fcntl is not None:
+            fcntl.flock(self.file_object.fileno(), fcntl.LOCK_UN)
+        else:
+            self.file_object.seek(0)
+            msvcrt.locking(self.file_object.fileno(), msvcrt.LK_UNLCK, 1)
+        self.file_object.close()
+        self.file_object = None
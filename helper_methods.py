@@ -1,11 +1,132 @@
+import atexit
 import datetime
+import json
+import logging
+import logging.handlers
+import queue
+import threading
+
+# log levels, lower is more important
+ERROR, WARNING, NOTICE, INFO = 0, 1, 2, 3
+level_names = ("ERROR", "WARNING", "NOTICE", "INFO")
+logging.addLevelName(25, "NOTICE")
+logging_levels = (logging.ERROR, logging.WARNING, 25, logging.INFO)
+
+# messages less important than console_level are not printed,
+# and those less important than file_level are not written to file
+console_level = INFO
+file_level = INFO
+# default log file every message is written to too, see setup_logging
+log_file = None
+log_json = False
+log_writers = {}
+log_writers_lock = threading.Lock()
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """Formats log record as one json object per line"""
+
+    def format(self, record):
+        return json.dumps({
+            "time": datetime.datetime.fromtimestamp(
+                record.created).isoformat(),
+            "level": record.levelname,
+            "message": record.getMessage()
+        })
+
+
+class LogWriter(object):
+    """Background writer of log messages to rotating file
+
+    Messages are put on queue (QueueHandler) and written by
+    QueueListener thread, so logging a message never waits
+    for the disk.
+    """
+
+    def __init__(self, file_name, json_lines=False, max_bytes=1024 * 1024,
+                 backups=3):
+        """Initialize writer and start its thread
+
+        Params:
+            * file_name -> string -> Log file
+            * json_lines -> bool -> Write json objects instead of text
+            * max_bytes -> int -> Size at which file is rotated
+            * backups -> int -> Rotated files kept
+        """
+        self.handler = logging.handlers.RotatingFileHandler(
+            file_name, maxBytes=max_bytes, backupCount=backups,
+            encoding="utf-8")
+        if json_lines:
+            self.handler.setFormatter(JsonLinesFormatter())
+        else:
+            self.handler.setFormatter(logging.Formatter(
+                "%(asctime)s %(levelname)s %(message)s"))
+        self.queue = queue.Queue()
+        self.logger = logging.Logger("work_manager." + file_name)
+        self.logger.addHandler(logging.handlers.QueueHandler(self.queue))
+        self.listener = logging.handlers.QueueListener(self.queue,
+                                                       self.handler)
+        self.listener.start()
+
+    def write(self, level, message):
+        self.logger.log(logging_levels[level], message)
+
+    def close(self):
+        """Write queued messages and stop the thread"""
+        self.listener.stop()
+        self.handler.close()
+
+
+def log_writer(file_name):
+    """Return LogWriter of file_name, started on first use"""
+    writer = log_writers.get(file_name)
+    if writer is None:
+        with log_writers_lock:
+            writer = log_writers.get(file_name)
+            if writer is None:
+                writer = LogWriter(file_name, log_json)
+                log_writers[file_name] = writer
+    return writer
+
+
+def setup_logging(file_name=None, level=INFO, console=INFO,
+                  json_lines=False):
+    """Configure log levels and default log file
+
+    Params:
+        * file_name -> string -> File every message is written to
+        too, None for none
+        * level -> int -> Least important level written to file
+        * console -> int -> Least important level printed
+        * json_lines -> bool -> Write log file as json lines
+    """
+    global console_level, file_level, log_file, log_json
+    console_level = console
+    file_level = level
+    log_file = file_name
+    log_json = json_lines
+    if file_name is not None:
+        log_writer(file_name)
+
+
+def stop_logging():
+    """Write all queued messages and stop log writers"""
+    with log_writers_lock:
+        for writer in log_writers.values():
+            writer.close()
+        log_writers.clear()
+
+
+atexit.register(stop_logging)
 
 
 def log(level, message, file_name=None):
     """Log messages to stdout or file
-    TODO : Add file support
 
-    This method will log messages from script
+    This method will log messages from script. Message is
+    printed, and written to log file if one was set up (see
+    setup_logging). If file_name is supplied, message goes only
+    to that file. Writing to file is done in background.
 
     Levels :
         0 -> ERROR
@@ -13,13 +134,51 @@ def log(level, message, file_name=None):
         2 -> NOTICE
         3 -> INFO
     """
-    if file_name is None:
+    if file_name is not None:
+        if level <= file_level:
+            log_writer(file_name).write(level, message)
+        return
+    if level <= console_level:
         print(message)
-    else:
-        pass
+    if log_file is not None and level <= file_level:
+        log_writer(log_file).write(level, message)
 
 
 def chop_microseconds(delta):
     return delta - datetime.timedelta(
         microseconds=delta.microseconds
     )
+
+
+# naive wall-clock epoch, sessions are stored as seconds since it
+EPOCH = datetime.datetime(1970, 1, 1)
+EPOCH_ORDINAL = EPOCH.toordinal()
+
+
+def to_epoch(dt):
+    """Return whole seconds from EPOCH to naive datetime dt"""
+    delta = dt - EPOCH
+    return delta.days * 86400 + delta.seconds
+
+
+def from_epoch(seconds):
+    """Return naive datetime for epoch seconds"""
+    return EPOCH + datetime.timedelta(seconds=seconds)
+
+
+def epoch_to_ordinal(seconds):
+    """Return date ordinal of the day epoch seconds fall in"""
+    return EPOCH_ORDINAL + seconds // 86400
+
+
+def ordinal_to_epoch(ordinal):
+    """Return epoch seconds of midnight starting date ordinal"""
+    return (ordinal - EPOCH_ORDINAL) * 86400
+
+
+def day_seconds(start, end):
+    """Yield (date ordinal, seconds) of start..end split at midnights"""
+    while start < end:
+        midnight = (start // 86400 + 1) * 86400
+        yield EPOCH_ORDINAL + start // 86400, min(end, midnight) - start
+        start = midnight
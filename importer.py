@@ -0,0 +1,52 @@
+import csv
+import json
+
+# Import files hold one session per row, with start_time, end_time
+# and paid in the same format add_session takes them. Files ending
+# with .jsonl or .json are json lines, one object per line:
+#   {"start_time": "01/01/2026 10:00:00", "end_time": ..., "paid": false}
+# Other files are csv, with optional start_time,end_time,paid header.
+
+
+def read_rows(file_name):
+    """Stream (line, startTime, endTime, paid) rows of import file"""
+    if file_name.endswith((".jsonl", ".json")):
+        return read_json_lines(file_name)
+    return read_csv(file_name)
+
+
+def paid_string(paid):
+    if isinstance(paid, bool):
+        return "true" if paid else "false"
+    return str(paid).strip().lower()
+
+
+def read_csv(file_name):
+    with open(file_name, newline='') as input_file:
+        for line, row in enumerate(csv.reader(input_file), 1):
+            if not row or (line == 1 and row[0].strip() == "start_time"):
+                continue
+            if len(row) != 3:
+                yield line, None, None, None
+                continue
+            yield line, row[0].strip(), row[1].strip(), paid_string(row[2])
+
+
+def read_json_lines(file_name):
+    with open(file_name) as input_file:
+        for line, text in enumerate(input_file, 1):
+            if not text.strip():
+                continue
+            try:
+                row = json.loads(text)
+                start_time, end_time = row["start_time"], row["end_time"]
+                paid = row.get("paid", False)
+            except (ValueError, KeyError, TypeError, AttributeError):
+                yield line, None, None, None
+                continue
+            if (not isinstance(start_time, str) or
+                    not isinstance(end_time, str) or
+                    not isinstance(paid, (str, bool))):
+                yield line, None, None, None
+                continue
+            yield line, start_time, end_time, paid_string(paid)
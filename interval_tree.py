@@ -0,0 +1,150 @@
+from itertools import count
+import random
+
+
+class Node(object):
+    """Single interval in IntervalTree"""
+
+    __slots__ = ("key", "end", "item", "priority", "left", "right",
+                 "max_end")
+
+    def __init__(self, key, end, item, priority):
+        self.key = key
+        self.end = end
+        self.item = item
+        self.priority = priority
+        self.left = None
+        self.right = None
+        self.max_end = end
+
+    def update(self):
+        """Recalculate max_end from children"""
+        max_end = self.end
+        if self.left is not None and self.left.max_end > max_end:
+            max_end = self.left.max_end
+        if self.right is not None and self.right.max_end > max_end:
+            max_end = self.right.max_end
+        self.max_end = max_end
+
+
+class IntervalTree(object):
+    """Set of [start, end) intervals with overlap queries
+
+    This is treap ordered by interval start, where every node
+    also keeps biggest end in its subtree, so subtrees which
+    end before queried range are skipped. Insert and remove are
+    O(log n), overlap query is O(log n + k) for k results.
+    """
+
+    def __init__(self):
+        self.root = None
+        self.keys = {}
+        self.counter = count()
+
+    def __len__(self):
+        return len(self.keys)
+
+    def new_node(self, start, end, item):
+        key = (start, next(self.counter))
+        self.keys[item] = key
+        return Node(key, end, item, random.random())
+
+    def build(self, intervals):
+        """Replace content with (start, end, item) intervals
+
+        Intervals are sorted and tree is built in O(n) with
+        stack based cartesian tree construction.
+        """
+        self.root = None
+        self.keys = {}
+        stack = []
+        for start, end, item in sorted(intervals, key=lambda i: i[0]):
+            node = self.new_node(start, end, item)
+            last = None
+            while stack and stack[-1].priority < node.priority:
+                last = stack.pop()
+                last.update()
+            node.left = last
+            if stack:
+                stack[-1].right = node
+            stack.append(node)
+        # node with highest priority stays at the bottom of the stack
+        if stack:
+            self.root = stack[0]
+        while stack:
+            stack.pop().update()
+
+    @staticmethod
+    def split(node, key):
+        """Split subtree into nodes with key < key and the rest"""
+        if node is None:
+            return None, None
+        if node.key < key:
+            node.right, right = IntervalTree.split(node.right, key)
+            node.update()
+            return node, right
+        left, node.left = IntervalTree.split(node.left, key)
+        node.update()
+        return left, node
+
+    @staticmethod
+    def merge(left, right):
+        """Merge subtrees where all keys in left are below right"""
+        if left is None:
+            return right
+        if right is None:
+            return left
+        if left.priority > right.priority:
+            left.right = IntervalTree.merge(left.right, right)
+            left.update()
+            return left
+        right.left = IntervalTree.merge(left, right.left)
+        right.update()
+        return right
+
+    def insert(self, start, end, item):
+        """Add interval [start, end) holding item"""
+        node = self.new_node(start, end, item)
+        left, right = self.split(self.root, node.key)
+        self.root = self.merge(self.merge(left, node), right)
+
+    def remove(self, item):
+        """Remove interval holding item, return if it was there"""
+        key = self.keys.pop(item, None)
+        if key is None:
+            return False
+        self.root = self._remove(self.root, key)
+        return True
+
+    def _remove(self, node, key):
+        if node.key == key:
+            return self.merge(node.left, node.right)
+        if key < node.key:
+            node.left = self._remove(node.left, key)
+        else:
+            node.right = self._remove(node.right, key)
+        node.update()
+        return node
+
+    def overlapping(self, lo, hi):
+        """Return items of intervals overlapping [lo, hi), by start"""
+        result = []
+        stack = []
+        node = self.root
+        # in order traversal, skipping subtrees ending before lo
+        # and everything starting at hi or later
+        while stack or node is not None:
+            if node is not None:
+                if node.max_end <= lo:
+                    node = None
+                    continue
+                stack.append(node)
+                node = node.left
+                continue
+            node = stack.pop()
+            if node.key[0] >= hi:
+                break
+            if node.end > lo:
+                result.append(node.item)
+            node = node.right
+        return result
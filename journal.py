@@ -0,0 +1,182 @@
+import glob
+import json
+import os
+import threading
+from crypto import MyCrypto
+
+
+class Journal(object):
+    """Append-only log of encrypted operation records
+
+    Every change to the session file (session started, stopped,
+    added, removed, marked paid, price changed) is queued here
+    as soon as it happens, and flush appends queued records to
+    the file, so saving costs only the size of the change. Each
+    record is a json dict with "op" and "seq" keys, seq grows by
+    one for every record. append and flush may be called from
+    different threads.
+
+    Files:
+        {file_name} -> current journal
+        {file_name}.{seq} -> journals rotated away by compaction,
+        seq is the last seq in it. They are removed once a
+        snapshot containing them is written.
+    """
+
+    def __init__(self, file_name, password):
+        """Initialize journal
+
+        Params:
+            * file_name -> string -> Path of current journal file
+            * password -> string/KeyRing -> Password for encryption
+        """
+        self.file_name = file_name
+        self.keyring = MyCrypto.keyring(password)
+        self.key = None
+        self.seq = 0
+        self.header = None
+        self.records = 0
+        # encoded records not written yet
+        self.pending = []
+        self.lock = threading.Lock()
+        # held while file is written
+        self.write_lock = threading.Lock()
+
+    def rotated_files(self):
+        """Return rotated journal files sorted by their last seq"""
+        files = []
+        for name in glob.glob(glob.escape(self.file_name) + ".*"):
+            suffix = name[len(self.file_name) + 1:]
+            if suffix.isdigit():
+                files.append((int(suffix), name))
+        return [name for (seq, name) in sorted(files)]
+
+    def read_file(self, file_name, repair=False):
+        """Yield decrypted records of single journal file
+
+        Record cut off or left half written by crash in the
+        middle of append ends the journal, if repair is set it is
+        also removed from the file so appending can continue after
+        it. Record failing authentication is torn write only if no
+        authentic record follows it, otherwise ValueError is raised.
+        """
+        with open(file_name, 'rb+' if repair else 'rb') as file_object:
+            version, header, fields = MyCrypto.read_header(file_object)
+            if version == 0:
+                # crash while header was written, nothing was appended
+                if repair:
+                    file_object.truncate(0)
+                return
+            key = self.keyring.key_for(fields)
+            index = 0
+            while True:
+                good_end = file_object.tell()
+                try:
+                    record = MyCrypto.open_record(file_object, key, header,
+                                                  index)
+                except ValueError:
+                    if self.authentic_record(file_object, key, header,
+                                             index + 1):
+                        raise
+                    record = None
+                except EOFError:
+                    record = None
+                if record is None:
+                    if repair and file_object.seek(0, os.SEEK_END) > good_end:
+                        file_object.truncate(good_end)
+                    break
+                index += 1
+                yield json.loads(record[0].decode('utf-8'))
+            if repair:
+                self.header = header
+                self.key = key
+                self.records = index
+
+    @staticmethod
+    def authentic_record(file_object, key, header, index):
+        """Return if authentic record is at file object position"""
+        try:
+            return MyCrypto.open_record(file_object, key, header,
+                                        index) is not None
+        except (ValueError, EOFError):
+            return False
+
+    def replay(self, after_seq=0, repair=True):
+        """Yield records with seq above after_seq, oldest first
+
+        With repair this also opens current journal for appending,
+        without it journal files are only read.
+        """
+        self.seq = after_seq
+        for name in self.rotated_files():
+            for record in self.read_file(name):
+                if record["seq"] > self.seq:
+                    self.seq = record["seq"]
+                    yield record
+        if os.path.exists(self.file_name):
+            for record in self.read_file(self.file_name, repair=repair):
+                if record["seq"] > self.seq:
+                    self.seq = record["seq"]
+                    yield record
+
+    def append(self, op, **fields):
+        """Queue operation record, it is written by flush"""
+        with self.lock:
+            self.seq += 1
+            fields["op"] = op
+            fields["seq"] = self.seq
+            self.pending.append(
+                json.dumps(fields, sort_keys=True).encode('utf-8'))
+
+    def flush(self, fsync=False):
+        """Encrypt queued records and append them in one write"""
+        with self.write_lock:
+            self.write_pending(fsync)
+
+    def write_pending(self, fsync=False):
+        """Write queued records, return seq of the last one written"""
+        with self.lock:
+            pending, self.pending = self.pending, []
+            seq = self.seq
+        if pending:
+            if self.header is None:
+                self.header, self.key = MyCrypto.make_header(self.keyring)
+                self.records = 0
+                with open(self.file_name, 'wb') as output:
+                    output.write(self.header)
+            records = []
+            for data in pending:
+                records.append(MyCrypto.seal_record(
+                    data, self.key, self.header, self.records, False))
+                self.records += 1
+            with open(self.file_name, 'ab') as output:
+                output.write(b"".join(records))
+                MyCrypto.sync_file(output, fsync)
+        return seq
+
+    def size(self):
+        """Return size of current journal file in bytes"""
+        if os.path.exists(self.file_name):
+            return os.path.getsize(self.file_name)
+        return 0
+
+    def rotate(self):
+        """Move current journal away, so new records start a new file
+
+        Queued records are written first. Return seq of last
+        record in rotated journal.
+        """
+        with self.write_lock:
+            seq = self.write_pending()
+            if self.records:
+                os.replace(self.file_name,
+                           "{}.{}".format(self.file_name, seq))
+                self.header = None
+                self.records = 0
+            return seq
+
+    def discard(self, up_to_seq):
+        """Remove rotated journals with records up to up_to_seq"""
+        for name in self.rotated_files():
+            if int(name[len(self.file_name) + 1:]) <= up_to_seq:
+                os.remove(name)
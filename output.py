@@ -0,0 +1,115 @@
+import shutil
+import sys
+
+# lines collected before they are written to the stream at once
+buffer_lines = 512
+
+
+class OutputWriter(object):
+    """Buffered line writer for long command output
+
+    Lines are joined and written in batches instead of one
+    print per line. Paged output stops after every screen
+    until Enter is pressed, q stops it, and after that every
+    write is ignored, so callers can check stopped and skip
+    formatting the rest.
+    """
+
+    def __init__(self, stream=None, page_size=None):
+        """Initialize writer
+
+        Params:
+            * stream -> file -> Where lines go, sys.stdout by default
+            * page_size -> int -> Lines per page, None to not page
+        """
+        self.stream = sys.stdout if stream is None else stream
+        self.page_size = page_size
+        self.buffer = []
+        self.page_lines = 0
+        self.stopped = False
+
+    @staticmethod
+    def open(out=None, page=False):
+        """Return writer to file out, or to stdout
+
+        Params:
+            * out -> string -> File name, None for stdout
+            * page -> bool -> Page output, only if stdout and stdin
+            are terminals
+        """
+        if out is not None:
+            return OutputWriter(open(out, "w"))
+        page_size = None
+        if page and sys.stdout.isatty() and sys.stdin.isatty():
+            page_size = max(shutil.get_terminal_size().lines - 1, 1)
+        return OutputWriter(page_size=page_size)
+
+    def write(self, line):
+        """Write one line, without line end"""
+        if self.stopped:
+            return
+        self.buffer.append(line)
+        if self.page_size is not None:
+            self.page_lines += 1
+            if self.page_lines >= self.page_size:
+                self.flush()
+                self.page_lines = 0
+                if input("-- More -- (Enter, q to quit) ").strip() == "q":
+                    self.stopped = True
+        elif len(self.buffer) >= buffer_lines:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            self.buffer.append("")
+            self.stream.write("\n".join(self.buffer))
+            self.buffer = []
+        self.stream.flush()
+
+    def close(self):
+        """Write buffered lines, and close stream if it is a file"""
+        self.flush()
+        if self.stream is not sys.stdout:
+            self.stream.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def parse_options(arguments):
+    """Split output options from command arguments
+
+    Params:
+        * arguments -> list -> Command arguments
+
+    Options are --limit N (print at most N sessions), --since DATE
+    (skip dates before DATE), --page and --out FILE. Return
+    (other arguments, options dict), ValueError is raised for
+    invalid option.
+    """
+    options = {"limit": None, "since": None, "page": False, "out": None}
+    rest = []
+    arguments = iter(arguments)
+    for argument in arguments:
+        if argument == "--page":
+            options["page"] = True
+        elif argument in ("--limit", "--since", "--out"):
+            value = next(arguments, None)
+            if value is None:
+                raise ValueError("Option %s needs a value" % argument)
+            options[argument[2:]] = value
+        elif argument.startswith("--"):
+            raise ValueError("Unknown option %s" % argument)
+        elif argument:
+            rest.append(argument)
+    if options["limit"] is not None:
+        try:
+            options["limit"] = int(options["limit"])
+        except ValueError:
+            options["limit"] = -1
+        if options["limit"] < 0:
+            raise ValueError("Limit must be a number of sessions")
+    return rest, options
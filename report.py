@@ -0,0 +1,129 @@
+"""Report unpaid hours and earnings of many session files
+
+Usage:
+    python report.py --password-env WTM_PASSWORD
+    python report.py --key-file keys.txt alice bob --workers 4
+
+Session files (all in session_files/ if none are named) are
+decrypted and summed in parallel worker processes, and line for
+each of them is printed as soon as it is done. Totals follow at
+the end, amounts summed per currency. Password options are the
+same as in batch.py. Files are only read, without locking, so
+report works while they are open in server or elsewhere.
+"""
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import contextlib
+import io
+import os
+import sys
+
+import batch
+import work_manager
+from work_manager import WorkManager
+
+# suffixes of files next to session files which are not session files
+companion_suffixes = (".journal", ".lock", ".tmp", ".sock")
+
+
+def session_names(directory):
+    """Return names of session files in directory"""
+    names = []
+    for name in sorted(os.listdir(directory)):
+        if not os.path.isfile(os.path.join(directory, name)):
+            continue
+        # rotated journals are named {file}.journal.{seq}
+        if name.endswith(companion_suffixes) or ".journal." in name:
+            continue
+        names.append(name)
+    return names
+
+
+def file_totals(name, password):
+    """Return totals of session file name, runs in worker process"""
+    ses_file = work_manager.sessions_storage.format(filename=name)
+    if not os.path.exists(ses_file):
+        return {"name": name, "error": "Session file doesn't exist"}
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            manager = WorkManager(ses_file, password, autosave=False,
+                                  read_only=True)
+            try:
+                sessions = manager.session_manager
+                hours, amount = sessions.calculate_price(
+                    manager.hourly_price)
+                return {
+                    "name": name,
+                    "hours": hours,
+                    "amount": amount,
+                    "paid_hours": sessions.total_paid / (60 * 60),
+                    "currency": manager.currency
+                }
+            finally:
+                manager.close()
+    except (ValueError, IOError) as e:
+        return {"name": name, "error": str(e)}
+
+
+def report(names, credentials, workers=None):
+    """Print totals of session files as they complete
+
+    Return number of files which couldn't be read.
+    """
+    width = max([len(name) for name in names] + [5])
+    row = "{name:<%s} {hours:>10.2f} h unpaid {amount:>12.2f} {currency:<4}" \
+          " {paid_hours:>10.2f} h paid" % width
+    hours, paid_hours, amounts, failed = 0.0, 0.0, {}, 0
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = []
+        for name in names:
+            try:
+                password = credentials.password_for(name)
+            except ValueError as e:
+                print("{name:<{width}} {error}".format(
+                    name=name, width=width, error=e))
+                failed += 1
+                continue
+            futures.append(executor.submit(file_totals, name, password))
+        for future in as_completed(futures):
+            totals = future.result()
+            if "error" in totals:
+                print("{name:<{width}} {error}".format(width=width,
+                                                       **totals))
+                failed += 1
+                continue
+            print(row.format(**totals))
+            sys.stdout.flush()
+            hours += totals["hours"]
+            paid_hours += totals["paid_hours"]
+            amounts[totals["currency"]] = (
+                amounts.get(totals["currency"], 0.0) + totals["amount"])
+    print("{name:<{width}} {hours:>10.2f} h unpaid {amounts} "
+          "{paid_hours:>10.2f} h paid".format(
+              name="Total", width=width, hours=hours, paid_hours=paid_hours,
+              amounts=", ".join("%.2f %s" % (amount, currency)
+                                for currency, amount
+                                in sorted(amounts.items()))))
+    return failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    batch.add_credentials_arguments(parser)
+    parser.add_argument("names", nargs="*", metavar="NAME",
+                        help="session files, all if not supplied")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="worker processes, number of CPUs by default")
+    args = parser.parse_args()
+    credentials = batch.credentials_from_arguments(args)
+    names = args.names or session_names(
+        os.path.dirname(work_manager.sessions_storage))
+    if not names:
+        print("There are no session files")
+        return
+    if report(names, credentials, args.workers):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,321 @@
+"""Server keeping session files of many users open in one process
+
+Usage:
+    python server.py [--socket PATH | --port PORT]
+    python server.py --client NAME [--socket PATH | --port PORT]
+
+Session files are opened once, kept in memory and locked (see
+FileLock), so users connecting to the server don't pay for key
+derivation and decryption on every launch, and no other process
+can overwrite the file meanwhile. Changes are written by autosave
+thread of each WorkManager.
+
+Protocol is one json object per line in both directions:
+    {"open": name, "password": ..., "hourly_price": .., "currency": ..}
+        opens session_files/name for this connection, hourly_price
+        and currency are needed only when file is created
+    {"cmd": "calc 01/01/2018"}
+        runs command like in interactive program
+Every request is answered with {"ok": true, "output": text} or
+{"ok": false, "error": text}. Commands reading or writing files
+named by the client (import, export and --out option of
+print_sessions and ims) are refused, they could reach session files
+of other users.
+"""
+import argparse
+import asyncio
+import contextlib
+import hmac
+import io
+import json
+import os
+import socket
+import sys
+import threading
+import time
+from getpass import getpass
+
+from commands import CommandProcessor
+import helper_methods
+import work_manager
+from work_manager import WorkManager
+
+default_socket = "session_files/server.sock"
+# seconds between checks for idle session files
+idle_check_interval = 30.0
+# seconds after which file without clients is closed
+idle_timeout = 600.0
+# commands which read or write files named by the client
+file_commands = ("export", "import")
+
+
+class OutputRouter(object):
+    """sys.stdout replacement which lets threads capture their output
+
+    Commands print their results, and they run in worker
+    threads at the same time, so redirect_stdout can't be
+    used. Output of thread inside capture() goes to its buffer,
+    everything else to the original stream.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.local = threading.local()
+
+    def write(self, text):
+        buffer = getattr(self.local, "buffer", None)
+        if buffer is None:
+            return self.stream.write(text)
+        return buffer.write(text)
+
+    def flush(self):
+        self.stream.flush()
+
+    def isatty(self):
+        # captured output goes to client, it is never paged
+        if getattr(self.local, "buffer", None) is not None:
+            return False
+        return self.stream.isatty()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+    @contextlib.contextmanager
+    def capture(self):
+        """Collect output of current thread in returned StringIO"""
+        self.local.buffer = io.StringIO()
+        try:
+            yield self.local.buffer
+        finally:
+            self.local.buffer = None
+
+
+class Account(object):
+    """Session file kept open by the server"""
+
+    def __init__(self, manager):
+        self.manager = manager
+        self.processor = CommandProcessor([manager])
+        # commands of one file run one at a time
+        self.lock = asyncio.Lock()
+        self.clients = 0
+        self.last_used = time.monotonic()
+
+
+class Server(object):
+    """Serves commands of many users from one process"""
+
+    def __init__(self, output):
+        """Initialize server
+
+        Params:
+            * output -> OutputRouter -> Installed as sys.stdout
+        """
+        self.output = output
+        # session file path -> Account
+        self.accounts = {}
+        # session file path -> asyncio.Lock, held while it is opened
+        self.opening = {}
+
+    async def in_thread(self, function, *args):
+        """Run blocking function in worker thread"""
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(None, function, *args)
+
+    async def open_account(self, request):
+        """Return Account of requested file, opening it if needed"""
+        name = request["open"]
+        password = request["password"]
+        if not name or os.path.basename(name) != name or name in ("..", "."):
+            raise ValueError("Invalid session file name")
+        ses_file = work_manager.sessions_storage.format(filename=name)
+        lock = self.opening.setdefault(ses_file, asyncio.Lock())
+        async with lock:
+            account = self.accounts.get(ses_file)
+            if account is not None:
+                if not hmac.compare_digest(
+                        password.encode('utf-8'),
+                        account.manager.keyring.password.encode('utf-8')):
+                    raise ValueError("Wrong password")
+            else:
+                if (not os.path.exists(ses_file) and
+                        (request.get("hourly_price") is None or
+                         request.get("currency") is None)):
+                    raise ValueError("New session file needs hourly_price "
+                                     "and currency")
+                manager = await self.in_thread(
+                    self.quiet, WorkManager, ses_file, password,
+                    request.get("hourly_price"), request.get("currency"))
+                account = Account(manager)
+                self.accounts[ses_file] = account
+        account.clients += 1
+        account.last_used = time.monotonic()
+        return account
+
+    def quiet(self, function, *args):
+        with self.output.capture():
+            return function(*args)
+
+    def execute(self, account, cmd):
+        """Run command of account, return its output"""
+        with self.output.capture() as buffer:
+            with account.manager.state_lock:
+                account.processor.call(cmd)
+        return buffer.getvalue()
+
+    async def run(self, account, cmd):
+        parts = cmd.split(" ")
+        name = parts[0].strip().lower()
+        if name in file_commands:
+            return "Command %s is not available in server mode\n" % name
+        if "--out" in parts[1:]:
+            return "Option --out is not available in server mode\n"
+        async with account.lock:
+            try:
+                return await self.in_thread(self.execute, account, cmd)
+            finally:
+                account.last_used = time.monotonic()
+
+    async def handle(self, reader, writer):
+        """Serve one client connection"""
+        account = None
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line.decode('utf-8'))
+                    if "open" in request:
+                        if account is not None:
+                            account.clients -= 1
+                            account = None
+                        account = await self.open_account(request)
+                        output = ""
+                    elif account is None:
+                        raise ValueError("Open session file first")
+                    else:
+                        output = await self.run(account, request["cmd"])
+                    response = {"ok": True, "output": output}
+                except Exception as e:
+                    response = {"ok": False, "error": str(e)}
+                writer.write((json.dumps(response) + "\n").encode('utf-8'))
+                await writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            # client went away, or server is shutting down
+            pass
+        finally:
+            if account is not None:
+                account.clients -= 1
+                account.last_used = time.monotonic()
+            writer.close()
+
+    async def close_idle(self):
+        """Close session files nobody used for idle_timeout"""
+        now = time.monotonic()
+        for ses_file, account in list(self.accounts.items()):
+            async with account.lock:
+                if account.clients == 0 and \
+                        now - account.last_used > idle_timeout:
+                    del self.accounts[ses_file]
+                    await self.in_thread(self.quiet, account.manager.close)
+                    helper_methods.log(3, "Closed idle %s" % ses_file)
+
+    async def idle_loop(self):
+        while True:
+            await asyncio.sleep(idle_check_interval)
+            await self.close_idle()
+
+    async def close_all(self):
+        for ses_file, account in list(self.accounts.items()):
+            async with account.lock:
+                del self.accounts[ses_file]
+                await self.in_thread(self.quiet, account.manager.close)
+
+    async def serve(self, path=None, port=None):
+        """Serve on unix socket path, or on localhost port"""
+        if port is None:
+            if os.path.exists(path):
+                os.remove(path)
+            server = await asyncio.start_unix_server(self.handle, path=path)
+        else:
+            server = await asyncio.start_server(self.handle, "127.0.0.1",
+                                                port)
+        helper_methods.log(3, "Serving on %s" % (path if port is None
+                                                 else port))
+        closer = asyncio.ensure_future(self.idle_loop())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            closer.cancel()
+            await self.close_all()
+
+
+def client(name, path=None, port=None):
+    """Interactive client of the server"""
+    if port is None:
+        connection = socket.socket(socket.AF_UNIX)
+        connection.connect(path)
+    else:
+        connection = socket.create_connection(("127.0.0.1", port))
+    stream = connection.makefile('rw', encoding='utf-8')
+
+    def request(**fields):
+        stream.write(json.dumps(fields) + "\n")
+        stream.flush()
+        response = json.loads(stream.readline())
+        if not response["ok"]:
+            print(response["error"])
+        else:
+            sys.stdout.write(response["output"])
+        return response
+
+    print("Enter your password")
+    password = getpass(work_manager.prompt)
+    response = request(open=name, password=password)
+    if not response["ok"]:
+        if not response["error"].startswith("New session file"):
+            return
+        print("Enter your hourly price without currency")
+        hourly_price = input(work_manager.prompt)
+        print("Enter currency")
+        currency = input(work_manager.prompt)
+        if not request(open=name, password=password,
+                       hourly_price=hourly_price, currency=currency)["ok"]:
+            return
+    try:
+        while True:
+            cmd = input(work_manager.prompt)
+            if cmd == "exit":
+                break
+            request(cmd=cmd)
+    except (KeyboardInterrupt, EOFError):
+        print()
+    connection.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--socket", default=default_socket,
+                        help="unix socket path")
+    parser.add_argument("--port", type=int, default=None,
+                        help="listen on localhost port instead of socket")
+    parser.add_argument("--client", metavar="NAME",
+                        help="connect to server and open session file NAME")
+    work_manager.add_logging_arguments(parser)
+    args = parser.parse_args()
+    work_manager.setup_logging_from_arguments(args)
+    if args.client:
+        client(args.client, args.socket, args.port)
+        return
+    output = OutputRouter(sys.stdout)
+    sys.stdout = output
+    try:
+        asyncio.run(Server(output).serve(args.socket, args.port))
+    except KeyboardInterrupt:
+        helper_methods.log(3, "\nBye bye")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+import contextlib
+import cProfile
+import threading
+import time
+import tracemalloc
+
+# Instrumentation of hot paths. Timers collect latency histograms
+# with power of two buckets in microseconds, counters add up bytes
+# and events. Everything is in-process and cheap enough to be always
+# on, the stats command prints it.
+# Timer names used:
+#   command.<name> -> CommandProcessor.call of command
+#   crypto.kdf, crypto.encrypt, crypto.decrypt -> key derivation and
+#   encryption/decryption of one chunk
+#   load, save.journal, save.snapshot -> WorkManager load and saves
+#   serialize, deserialize -> encoding/decoding of state and months
+
+
+class Histogram(object):
+    """Latency histogram with power of two microsecond buckets"""
+
+    def __init__(self):
+        self.buckets = {}
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        # bucket i holds latencies below 2 ** i microseconds
+        bucket = int(seconds * 1000000).bit_length()
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, fraction):
+        """Return upper bound in seconds of latency percentile"""
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= fraction * self.count:
+                return min(2 ** bucket / 1000000.0, self.max)
+        return self.max
+
+
+class Stats(object):
+    """Registry of timers and counters, safe to use from threads"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.timers = {}
+        self.counters = {}
+
+    def add_time(self, name, seconds):
+        with self.lock:
+            histogram = self.timers.get(name)
+            if histogram is None:
+                histogram = self.timers[name] = Histogram()
+            histogram.add(seconds)
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    @contextlib.contextmanager
+    def timer(self, name):
+        """Time the with block into histogram name"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def reset(self):
+        with self.lock:
+            self.timers.clear()
+            self.counters.clear()
+
+    def report(self, histograms=False):
+        """Return lines describing all timers and counters
+
+        Params:
+            * histograms -> bool -> Add bucket lines under timers
+        """
+        lines = []
+        with self.lock:
+            for name in sorted(self.timers):
+                histogram = self.timers[name]
+                lines.append(
+                    "%s: %s calls, total %.3f ms, mean %.3f ms, p50 %.3f ms, "
+                    "p99 %.3f ms, max %.3f ms" % (
+                        name, histogram.count, histogram.total * 1000,
+                        histogram.total / histogram.count * 1000,
+                        histogram.percentile(0.5) * 1000,
+                        histogram.percentile(0.99) * 1000,
+                        histogram.max * 1000))
+                if histograms:
+                    widest = max(histogram.buckets.values())
+                    for bucket in sorted(histogram.buckets):
+                        count = histogram.buckets[bucket]
+                        lines.append(" |---< %10.3f ms %-40s %s" % (
+                            2 ** bucket / 1000.0,
+                            "#" * max(1, 40 * count // widest), count))
+            for name in sorted(self.counters):
+                lines.append("%s: %s" % (name, self.counters[name]))
+        return lines
+
+
+# stats of this process
+stats = Stats()
+
+
+class Capture(object):
+    """cProfile or tracemalloc capture written to file when stopped
+
+    cProfile sees only the thread which started it, so commands are
+    profiled but autosave thread is not. Profile is written in
+    pstats format (python -m pstats FILE), memory capture as text
+    with the lines that allocated most.
+    """
+
+    modes = ("profile", "memory")
+
+    def __init__(self, mode, file_name):
+        """Initialize capture
+
+        Params:
+            * mode -> string -> profile or memory
+            * file_name -> string -> File capture is written to
+        """
+        if mode not in self.modes:
+            raise ValueError("Capture mode must be one of %s" %
+                             ", ".join(self.modes))
+        self.mode = mode
+        self.file_name = file_name
+        self.profiler = None
+
+    def start(self):
+        if self.mode == "profile":
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        else:
+            tracemalloc.start()
+
+    def stop(self):
+        """Stop capture and write it to file"""
+        if self.mode == "profile":
+            self.profiler.disable()
+            self.profiler.dump_stats(self.file_name)
+            return
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        with open(self.file_name, "w") as output:
+            output.write("current %s bytes, peak %s bytes\n" %
+                         (current, peak))
+            for statistic in snapshot.statistics("lineno")[:50]:
+                output.write("%s\n" % statistic)
@@ -0,0 +1,35 @@
+import os
+import shutil
+import sys
+import tempfile
+from unittest import mock
+
+import pytest
+
+# modules of the program are flat files in the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+import helper_methods
+import work_manager
+
+
+@pytest.fixture
+def workspace(request):
+    """
+    Temporary directory for files of one test, also used as
+    sessions storage, with console logging quiet
+    It is set as directory of the test case
+    """
+    directory = tempfile.mkdtemp()
+    console_level = helper_methods.console_level
+    helper_methods.console_level = helper_methods.ERROR
+    if request.instance is not None:
+        request.instance.directory = directory
+    try:
+        with mock.patch.object(work_manager, "sessions_storage",
+                               os.path.join(directory, "{filename}")):
+            yield directory
+    finally:
+        helper_methods.console_level = console_level
+        shutil.rmtree(directory)
@@ -0,0 +1,31 @@
+import random
+import unittest
+
+from aggregates import FenwickTree
+
+
+class FenwickTreeTest(unittest.TestCase):
+    """Range sums of per-day values"""
+
+    def test_range_sums_match_brute_force(self):
+        generator = random.Random(3)
+        tree = FenwickTree()
+        values = {}
+        # dates of 2026 and both ends of the ordinal range
+        positions = ([generator.randrange(739617, 739982)
+                      for _ in range(300)] +
+                     [1, 2, FenwickTree.size - 1])
+        for index in positions:
+            value = generator.choice((-1, 1)) * generator.randrange(86400)
+            tree.add(index, value)
+            values[index] = values.get(index, 0) + value
+        bounds = [(1, FenwickTree.size - 1), (739700, 739699),
+                  (FenwickTree.size - 1, FenwickTree.size - 1)]
+        for _ in range(300):
+            lo, hi = sorted(generator.randrange(739600, 740000)
+                            for _ in range(2))
+            bounds.append((lo, hi))
+        for lo, hi in bounds:
+            expected = sum(value for index, value in values.items()
+                           if lo <= index <= hi)
+            self.assertEqual(tree.range_sum(lo, hi), expected, (lo, hi))
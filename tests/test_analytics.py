@@ -0,0 +1,42 @@
+import unittest
+
+import analytics
+from work_manager import SessionManager
+
+
+class AnalyticsTest(unittest.TestCase):
+    """Engines over day totals of SessionManager"""
+
+    def setUp(self):
+        self.manager = SessionManager()
+        for start, end, paid in (
+                ("01/01/2026-22:00:00", "02/01/2026-02:00:00", "false"),
+                ("05/01/2026-10:00:00", "05/01/2026-12:00:00", "true"),
+                ("30/01/2026-20:00:00", "02/02/2026-04:00:00", "false")):
+            self.manager.add_session(start, end, paid)
+
+    def test_engine_follows_changes(self):
+        engine = self.manager.analytics()
+        self.assertEqual(engine.totals(), (60 * 3600.0, 2 * 3600.0))
+        self.manager.add_session("10/02/2026-10:00:00",
+                                 "10/02/2026-11:00:00", "false")
+        self.assertEqual(self.manager.analytics().totals(),
+                         (61 * 3600.0, 2 * 3600.0))
+
+    @unittest.skipIf(analytics.numpy is None, "numpy is not installed")
+    def test_engines_agree(self):
+        python = analytics.PythonEngine(self.manager)
+        vectorized = analytics.NumpyEngine(self.manager)
+        lo = self.manager.parse_date("02/01/2026")
+        hi = self.manager.parse_date("01/02/2026")
+        for bucket in analytics.BUCKETS:
+            for bounds in ((None, None), (lo, hi)):
+                self.assertEqual(python.histogram(bucket, *bounds),
+                                 vectorized.histogram(bucket, *bounds))
+        self.assertEqual(python.daily(lo, hi), vectorized.daily(lo, hi))
+        self.assertEqual(python.moving_average(7, lo, hi),
+                         vectorized.moving_average(7, lo, hi))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,23 @@
+import contextlib
+import io
+import unittest
+
+import pytest
+
+from batch import Batch, Credentials
+
+
+@pytest.mark.usefixtures("workspace")
+class BatchTest(unittest.TestCase):
+    """Commands of many session files"""
+
+    def test_failed_lines_are_reported_with_number(self):
+        batch = Batch(Credentials({"*": "password"}))
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            failed = batch.run(["open alice 10 EUR", "", "bogus 1",
+                                "remove_sessions 01/01/2026", "calc"])
+        self.assertEqual(failed, 1)
+        self.assertIn("Line 3 (bogus 1) failed: The command doesn't exist",
+                      output.getvalue())
+        self.assertIn("You worked 0.0 hours", output.getvalue())
+
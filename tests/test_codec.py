@@ -0,0 +1,30 @@
+import unittest
+
+from codec import BinaryCodec, JsonCodec, get_codec
+
+
+class CodecTest(unittest.TestCase):
+    """Rows of session segments encoded and decoded back"""
+
+    rows = [(1767261600, 1767268800, False),
+            (1767348000, 1767355200, True),
+            (-86400, 0, True),
+            (1767434400, None, False)]
+
+    def round_trip(self, codec, rows):
+        return list(codec.decode_rows(b"".join(codec.encode_rows(rows))))
+
+    def test_rows_round_trip(self):
+        for codec in (JsonCodec, BinaryCodec):
+            # paid bitmap spans more than one byte
+            many = [(start * 60, start * 60 + 30, start % 3 == 0)
+                    for start in range(19)]
+            for rows in (self.rows, many, []):
+                self.assertEqual(self.round_trip(codec, rows), rows,
+                                 codec.name)
+
+    def test_codec_by_name(self):
+        self.assertIs(get_codec(None), JsonCodec)
+        self.assertIs(get_codec("binary"), BinaryCodec)
+        with self.assertRaises(ValueError):
+            get_codec("xml")
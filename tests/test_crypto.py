@@ -0,0 +1,128 @@
+import io
+import os
+import unittest
+
+import pytest
+
+from crypto import KeyRing, MyCrypto, SegmentedFile
+
+CHUNK = 16
+
+
+@pytest.mark.usefixtures("workspace")
+class CryptoTest(unittest.TestCase):
+    """Chunked and segmented encrypted files"""
+
+    @classmethod
+    def setUpClass(cls):
+        # keys are derived once, KDF is slow on purpose
+        cls.keyring = KeyRing("password")
+
+    def setUp(self):
+        self.file_name = os.path.join(self.directory, "file")
+
+    def write(self, data, pieces=None):
+        MyCrypto.write_chunks(pieces or [data], self.file_name, self.keyring,
+                              chunk_size=CHUNK)
+
+    def read(self):
+        return bytes(MyCrypto.read_with_header(self.file_name,
+                                               self.keyring)[1])
+
+    def stream(self):
+        return b"".join(MyCrypto.read_chunks(self.file_name, self.keyring))
+
+    def assert_rejected(self):
+        for read in (self.read, self.stream):
+            with self.assertRaises(ValueError):
+                read()
+
+    def test_round_trip_at_chunk_boundaries(self):
+        for size in (0, 1, CHUNK - 1, CHUNK, CHUNK + 1, 2 * CHUNK,
+                     3 * CHUNK, 3 * CHUNK + 5):
+            data = os.urandom(size)
+            pieces = [data[i:i + 7] for i in range(0, size, 7)]
+            for written in ([data], pieces):
+                self.write(data, written)
+                self.assertEqual(self.read(), data, size)
+                self.assertEqual(self.stream(), data, size)
+
+    def test_exact_multiple_has_no_empty_last_chunk(self):
+        blocks = list(MyCrypto.rechunk([b"x" * (2 * CHUNK)], CHUNK))
+        self.assertEqual(blocks, [(b"x" * CHUNK, False),
+                                  (b"x" * CHUNK, True)])
+        self.assertEqual(list(MyCrypto.rechunk([], CHUNK)), [(b"", True)])
+
+    def test_tampered_file_is_rejected(self):
+        self.write(os.urandom(3 * CHUNK))
+        with open(self.file_name, "rb") as input_file:
+            content = bytearray(input_file.read())
+        for position in (len(content) - 1, len(content) - 60):
+            tampered = bytearray(content)
+            tampered[position] ^= 1
+            with open(self.file_name, "wb") as output:
+                output.write(tampered)
+            self.assert_rejected()
+
+    def test_truncated_file_is_rejected(self):
+        self.write(os.urandom(3 * CHUNK))
+        with open(self.file_name, "rb") as input_file:
+            content = input_file.read()
+        header = MyCrypto.read_header(io.BytesIO(content))[1]
+        record = (len(content) - len(header)) // 3
+        # cut at record boundary drops whole last chunk
+        for length in (len(content) - record, len(content) - 1,
+                       len(content) - record - 10):
+            with open(self.file_name, "wb") as output:
+                output.write(content[:length])
+            self.assert_rejected()
+
+    def test_data_after_last_chunk_is_rejected(self):
+        self.write(os.urandom(2 * CHUNK))
+        with open(self.file_name, "ab") as output:
+            output.write(b"\x00")
+        self.assert_rejected()
+
+    def test_wrong_password_is_rejected(self):
+        self.write(b"secret")
+        with self.assertRaises(ValueError):
+            MyCrypto.read_with_header(self.file_name, "other")
+
+    def test_segments_round_trip(self):
+        segments = [("empty", b""), ("exact", os.urandom(2 * CHUNK)),
+                    ("odd", os.urandom(CHUNK + 3))]
+        MyCrypto.write_segments([(name, [data]) for name, data in segments],
+                                self.file_name, self.keyring,
+                                chunk_size=CHUNK)
+        snapshot = SegmentedFile(self.file_name, self.keyring)
+        try:
+            self.assertEqual(sorted(snapshot.names()),
+                             ["empty", "exact", "odd"])
+            for name, data in segments:
+                self.assertEqual(bytes(snapshot.read_segment(name)), data)
+        finally:
+            snapshot.close()
+
+    def test_tampered_segment_is_rejected(self):
+        MyCrypto.write_segments([("month", [os.urandom(2 * CHUNK)])],
+                                self.file_name, self.keyring,
+                                chunk_size=CHUNK)
+        with open(self.file_name, "rb") as input_file:
+            content = bytearray(input_file.read())
+        snapshot = SegmentedFile(self.file_name, self.keyring)
+        offset = snapshot.index["month"][0]
+        snapshot.close()
+        content[offset + 40] ^= 1
+        with open(self.file_name, "wb") as output:
+            output.write(content)
+        snapshot = SegmentedFile(self.file_name, self.keyring)
+        try:
+            with self.assertRaises(ValueError):
+                snapshot.read_segment("month")
+        finally:
+            snapshot.close()
+        with open(self.file_name, "wb") as output:
+            output.write(content[:-20])
+        with self.assertRaises(ValueError):
+            SegmentedFile(self.file_name, self.keyring)
+
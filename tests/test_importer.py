@@ -0,0 +1,46 @@
+import os
+import unittest
+
+import pytest
+
+import importer
+from work_manager import SessionManager
+
+
+@pytest.mark.usefixtures("workspace")
+class ImporterTest(unittest.TestCase):
+    """Rows of import files"""
+
+    def write(self, name, text):
+        file_name = os.path.join(self.directory, name)
+        with open(file_name, "w") as output:
+            output.write(text)
+        return file_name
+
+    def test_json_lines_with_wrong_types_are_rejected(self):
+        file_name = self.write("rows.jsonl", "\n".join([
+            '{"start_time": "01/01/2026 10:00:00", '
+            '"end_time": "01/01/2026 11:00:00", "paid": true}',
+            '{"start_time": 5, "end_time": "01/01/2026 13:00:00"}',
+            '{"start_time": "02/01/2026 10:00:00", "end_time": null}',
+            '{"start_time": "03/01/2026 10:00:00", '
+            '"end_time": "03/01/2026 11:00:00", "paid": [1]}',
+            '["01/01/2026 10:00:00"]',
+            '"text"',
+            '{"start_time": "04/01/2026 10:00:00", '
+            '"end_time": "04/01/2026 11:00:00"}',
+        ]) + "\n")
+        manager = SessionManager()
+        accepted, rejected = manager.import_sessions(
+            importer.read_rows(file_name))
+        self.assertEqual(len(accepted), 2)
+        self.assertEqual(rejected, [(line, "bad format")
+                                    for line in range(2, 7)])
+
+    def test_rows_with_wrong_types_are_rejected(self):
+        manager = SessionManager()
+        accepted, rejected = manager.import_sessions(
+            [(1, 5, 6, "false"), (2, "01/01/2026 10:00:00", [], "false")])
+        self.assertEqual((accepted, rejected),
+                         ([], [(1, "bad format"), (2, "bad format")]))
+
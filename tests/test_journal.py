@@ -0,0 +1,126 @@
+import os
+import unittest
+
+import pytest
+
+from commands import CommandProcessor
+from crypto import KeyRing
+from journal import Journal
+from work_manager import WorkManager
+
+
+@pytest.mark.usefixtures("workspace")
+class JournalTest(unittest.TestCase):
+    """Journal files and replaying them over snapshot"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.keyring = KeyRing("password")
+
+    def test_record_cut_off_is_repaired(self):
+        file_name = os.path.join(self.directory, "journal")
+        journal = Journal(file_name, self.keyring)
+        for value in range(3):
+            journal.append("price", value=value)
+        journal.flush()
+        size = os.path.getsize(file_name)
+        # crash in the middle of appending fourth record
+        journal.append("price", value=3)
+        journal.flush()
+        with open(file_name, "r+b") as journal_file:
+            journal_file.truncate(size + 20)
+
+        journal = Journal(file_name, self.keyring)
+        self.assertEqual([record["value"] for record in journal.replay()],
+                         [0, 1, 2])
+        self.assertEqual(os.path.getsize(file_name), size)
+        journal.append("price", value=4)
+        journal.flush()
+
+        journal = Journal(file_name, self.keyring)
+        self.assertEqual([(record["seq"], record["value"])
+                          for record in journal.replay()],
+                         [(1, 0), (2, 1), (3, 2), (4, 4)])
+
+    def test_half_written_record_is_repaired(self):
+        file_name = os.path.join(self.directory, "journal")
+        journal = Journal(file_name, self.keyring)
+        for value in range(2):
+            journal.append("price", value=value)
+        journal.flush()
+        size = os.path.getsize(file_name)
+        # crash left zero filled blocks where record was appended
+        with open(file_name, "ab") as journal_file:
+            journal_file.write(b"\x00" * 64)
+
+        journal = Journal(file_name, self.keyring)
+        self.assertEqual([record["value"] for record in journal.replay()],
+                         [0, 1])
+        self.assertEqual(os.path.getsize(file_name), size)
+
+    def test_damaged_record_before_authentic_one_is_rejected(self):
+        file_name = os.path.join(self.directory, "journal")
+        journal = Journal(file_name, self.keyring)
+        for value in range(3):
+            journal.append("price", value=value)
+            journal.flush()
+        with open(file_name, "rb") as journal_file:
+            content = bytearray(journal_file.read())
+        record = (len(content) - len(journal.header)) // 3
+        content[len(journal.header) + record + 40] ^= 1
+        with open(file_name, "wb") as journal_file:
+            journal_file.write(content)
+
+        journal = Journal(file_name, self.keyring)
+        with self.assertRaises(ValueError):
+            list(journal.replay())
+        self.assertEqual(os.path.getsize(file_name), len(content))
+
+    def test_read_only_replay_leaves_cut_record(self):
+        file_name = os.path.join(self.directory, "journal")
+        journal = Journal(file_name, self.keyring)
+        journal.append("price", value=1)
+        journal.flush()
+        with open(file_name, "ab") as journal_file:
+            journal_file.write(b"\x01" * 10)
+        size = os.path.getsize(file_name)
+        journal = Journal(file_name, self.keyring)
+        self.assertEqual(len(list(journal.replay(repair=False))), 1)
+        self.assertEqual(os.path.getsize(file_name), size)
+
+    def state(self, manager):
+        sessions = manager.session_manager
+        return (list(sessions.finished_rows()), sessions.total_unpaid,
+                sessions.total_paid, manager.hourly_price)
+
+    def test_snapshot_and_journals_replay_to_same_state(self):
+        ses_file = os.path.join(self.directory, "user")
+        manager = WorkManager(ses_file, "password", 10, "EUR",
+                              autosave=False)
+        processor = CommandProcessor([manager])
+        for day in ("05/01/2026", "06/01/2026", "03/02/2026"):
+            processor.call("add_session %s-09:00:00 %s-12:00:00 false" %
+                           (day, day))
+        manager.compact()
+        # compaction which crashed after rotating journal
+        processor.call("add_session 07/01/2026-09:00:00 "
+                       "07/01/2026-10:00:00 false")
+        processor.call("mark_paid 05/01/2026")
+        processor.call("change_h_price 12")
+        manager.journal.rotate()
+        processor.call("remove_sessions 06/01/2026 0")
+        processor.call("mark_paid 06/01/2026 08/01/2026")
+        processor.call("add_session 04/02/2026-09:00:00 "
+                       "04/02/2026-09:30:00 true")
+        manager.flush()
+        self.assertEqual(len(manager.journal.rotated_files()), 1)
+        expected = self.state(manager)
+        self.assertEqual((len(expected[0]), expected[1:]),
+                         (4, (3 * 3600, 4.5 * 3600, 12.0)))
+        manager.close()
+
+        manager = WorkManager(ses_file, "password", autosave=False)
+        self.assertEqual(self.state(manager), expected)
+        self.assertEqual(manager.journal.seq, 9)
+        manager.close()
+
@@ -0,0 +1,34 @@
+import os
+import unittest
+
+import pytest
+
+import report
+from work_manager import WorkManager
+
+
+@pytest.mark.usefixtures("workspace")
+class ReportTest(unittest.TestCase):
+    """Totals of session files opened elsewhere"""
+
+    def test_totals_of_locked_file_leave_it_untouched(self):
+        ses_file = os.path.join(self.directory, "alice")
+        manager = WorkManager(ses_file, "password", 10, "EUR",
+                              autosave=False)
+        manager.session_manager.add_session("01/01/2026-10:00:00",
+                                            "01/01/2026-12:00:00", "false")
+        manager.flush()
+        journal_file = manager.journal.file_name
+        # record being appended by the other process
+        with open(journal_file, "ab") as journal:
+            journal.write(b"\x00" * 7)
+        size = os.path.getsize(journal_file)
+
+        totals = report.file_totals("alice", "password")
+        self.assertEqual((totals["hours"], totals["amount"],
+                          totals["currency"]), (2.0, 20.0, "EUR"))
+        self.assertEqual(os.path.getsize(journal_file), size)
+        self.assertIn("password is incorrect",
+                      report.file_totals("alice", "other")["error"])
+        manager.close()
+
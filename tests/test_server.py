@@ -0,0 +1,29 @@
+import asyncio
+import io
+import unittest
+
+from server import OutputRouter, Server
+
+
+class ServerTest(unittest.TestCase):
+    """Commands refused before they reach session file"""
+
+    def run_command(self, cmd):
+        server = Server(OutputRouter(io.StringIO()))
+        return asyncio.run(server.run(None, cmd))
+
+    def test_file_commands_are_refused(self):
+        for cmd in ("export ../other.csv", "import /tmp/rows.csv",
+                    "EXPORT x.csv"):
+            self.assertIn("not available in server mode",
+                          self.run_command(cmd))
+
+    def test_output_to_file_is_refused(self):
+        for cmd in ("print_sessions --out session_files/other",
+                    "ims --limit 2 --out x"):
+            self.assertIn("--out is not available in server mode",
+                          self.run_command(cmd))
+
+
+if __name__ == "__main__":
+    unittest.main()
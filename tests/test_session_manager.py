@@ -0,0 +1,84 @@
+import io
+import unittest
+
+import analytics
+from output import OutputWriter
+from work_manager import SessionManager
+
+
+class SessionManagerTest(unittest.TestCase):
+    """Registering sessions and totals of them"""
+
+    def setUp(self):
+        self.manager = SessionManager()
+        # crosses midnight, 2 hours on 01/01 and 3 hours on 02/01
+        self.manager.add_session("01/01/2026-22:00:00",
+                                 "02/01/2026-03:00:00", "false")
+
+    def sessions(self, date1=None, date2=None):
+        stream = io.StringIO()
+        writer = OutputWriter(stream)
+        self.manager.print_sessions(date1, date2, writer)
+        writer.flush()
+        return stream.getvalue().splitlines()
+
+    def test_overlapping_session_is_not_added(self):
+        for start, end in (("02/01/2026-02:00:00", "02/01/2026-04:00:00"),
+                           ("01/01/2026-21:00:00", "01/01/2026-23:00:00"),
+                           ("01/01/2026-20:00:00", "02/01/2026-05:00:00")):
+            self.manager.add_session(start, end, "false")
+        self.manager.add_session("02/01/2026-03:00:00",
+                                 "02/01/2026-04:00:00", "false")
+        self.assertEqual(self.manager.calc_all(10), (6.0, 60.0))
+
+    def test_overlapping_imported_sessions_are_rejected(self):
+        accepted, rejected = self.manager.import_sessions([
+            (1, "02/01/2026-02:00:00", "02/01/2026-04:00:00", "false"),
+            (2, "03/01/2026-10:00:00", "03/01/2026-12:00:00", "false"),
+            (3, "03/01/2026-11:00:00", "03/01/2026-13:00:00", "false"),
+            (4, "03/01/2026-12:00:00", "03/01/2026-13:00:00", "false")])
+        self.assertEqual(len(accepted), 2)
+        self.assertEqual(rejected, [(1, "overlaps other session"),
+                                    (3, "overlaps other session")])
+        self.assertEqual(self.manager.calc_all(10), (8.0, 80.0))
+
+    def test_session_crossing_midnight_is_split_by_day(self):
+        self.assertEqual(self.manager.calculate_price(10, "01/01/2026"),
+                         (2.0, 20.0))
+        self.assertEqual(self.manager.calculate_price(10, "02/01/2026"),
+                         (3.0, 30.0))
+        # range bounds are exclusive
+        self.assertEqual(self.manager.calculate_price(10, "01/01/2026",
+                                                      "03/01/2026"),
+                         (3.0, 30.0))
+        self.assertEqual(self.sessions("02/01/2026"), [
+            "Date: 02/01/2026",
+            " |---Previous day : 22:00:00 - 03:00:00 , Unpaid"])
+        self.assertEqual(self.sessions(), [
+            "Date: 01/01/2026",
+            " |---22:00:00 - Next day : 03:00:00 , Unpaid",
+            "Date: 02/01/2026",
+            " |---Previous day : 22:00:00 - 03:00:00 , Unpaid"])
+
+    def test_rollups_follow_paid_marks_and_removals(self):
+        self.manager.add_session("10/02/2026-10:00:00",
+                                 "10/02/2026-11:00:00", "false")
+        january = self.manager.parse_date("01/01/2026")
+        february = self.manager.parse_date("01/02/2026")
+        week = analytics.bucket_of(january, "week")
+        self.assertEqual(self.manager.rollups_between("month"), [
+            (january, 5 * 3600.0, 0.0), (february, 3600.0, 0.0)])
+        self.assertEqual(self.manager.rollup("week", week), (5 * 3600.0, 0))
+
+        self.manager.mark_paid("01/01/2026")
+        # whole session is paid, also hours of next day
+        self.assertEqual(self.manager.rollup("month", january),
+                         (0, 5 * 3600.0))
+        self.assertEqual(self.manager.rollup("week", week), (0, 5 * 3600.0))
+        self.assertEqual(self.manager.rollup("month", february),
+                         (3600.0, 0.0))
+
+        self.manager.remove_sessions("01/01/2026", "0")
+        self.assertEqual(self.manager.rollups_between("month"), [
+            (february, 3600.0, 0.0)])
+        self.assertEqual(self.manager.rollup("week", week), (0, 0))
@@ -0,0 +1,54 @@
+from datetime import datetime
+import unittest
+
+import helper_methods
+import timeformat
+
+
+class TimeFormatTest(unittest.TestCase):
+    """Sliced parsing gives the same results as strptime"""
+
+    def assertSameAs(self, parse, strptime, text):
+        try:
+            expected = strptime(text)
+        except ValueError:
+            with self.assertRaises(ValueError, msg=text):
+                parse(text)
+        else:
+            self.assertEqual(parse(text), expected, text)
+
+    def test_dates(self):
+        def strptime(text):
+            return datetime.strptime(text, timeformat.date_format).toordinal()
+        for text in ("01/01/2026", "29/02/2024", "31/02/2026", "00/01/2026",
+                     "1/1/2026", "٠١/٠١/٢٠٢٦", "01/01/２０２６", "01-01-2026"):
+            self.assertSameAs(timeformat.parse_date, strptime, text)
+
+    def test_times(self):
+        def strptime(text):
+            parsed = datetime.strptime(text, timeformat.time_format)
+            return parsed.hour * 3600 + parsed.minute * 60 + parsed.second
+
+        def parse(text):
+            seconds = timeformat.parse_time(text)
+            if seconds is None:
+                raise ValueError(text)
+            return seconds
+        for text in ("00:00:00", "23:59:59", "24:00:00", "12:60:00",
+                     "1:2:3", "١٠:٠٠:٠٠", "10:00"):
+            self.assertSameAs(parse, strptime, text)
+
+    def test_datetimes(self):
+        def strptime(text):
+            return helper_methods.to_epoch(datetime.strptime(
+                text.replace("-", " "), timeformat.datetime_format))
+        for text in ("01/01/2026 10:00:00", "01/01/2026-23:59:59",
+                     "01/01/2026-24:00:00", "31/02/2026-10:00:00",
+                     "1/1/2026-10:00:00", "01/01/2026 1:2:3",
+                     "٠١/٠١/٢٠٢٦-10:00:00", "01/01/2026-١٠:00:00"):
+            self.assertSameAs(timeformat.parse_datetime, strptime, text)
+
+    def test_formatting_round_trip(self):
+        seconds = timeformat.parse_datetime("05/03/2026 07:08:09")
+        self.assertEqual(timeformat.format_datetime(seconds),
+                         "05/03/2026 07:08:09")
@@ -0,0 +1,246 @@
+import contextlib
+import io
+import json
+import os
+import unittest
+from unittest import mock
+
+import pytest
+
+from commands import CommandProcessor
+from crypto import MyCrypto, SegmentedFile
+import helper_methods
+import work_manager
+from work_manager import WorkManager
+
+
+@pytest.mark.usefixtures("workspace")
+class WorkManagerTest(unittest.TestCase):
+    """Opening, changing and reopening session files"""
+
+    def setUp(self):
+        self.ses_file = os.path.join(self.directory, "user")
+
+    def open(self):
+        return WorkManager(self.ses_file, "password", 10, "EUR",
+                           autosave=False)
+
+    def test_invalid_mark_date_is_not_journaled(self):
+        manager = self.open()
+        processor = CommandProcessor([manager])
+        processor.call("add_session 01/01/2026-10:00:00 "
+                       "01/01/2026-12:00:00 false")
+        for command in ("mark_paid 99/99/2026", "mark_unpaid 01/01/2026 x"):
+            with self.assertRaises(ValueError):
+                processor.call(command)
+        manager.close()
+
+        manager = self.open()
+        self.assertEqual(manager.session_manager.calc_all(10), (2.0, 20.0))
+        manager.close()
+
+    def test_invalid_journal_record_is_skipped(self):
+        # journal written by version which journaled before parsing
+        manager = self.open()
+        manager.session_manager.add_session("01/01/2026-10:00:00",
+                                            "01/01/2026-11:00:00", "false")
+        manager.session_manager.journal_op("mark", paid=True,
+                                           date1="99/99/2026", date2=None)
+        manager.session_manager.mark_paid("01/01/2026")
+        manager.close()
+
+        manager = self.open()
+        self.assertEqual(manager.session_manager.total_paid, 3600)
+        manager.close()
+
+    def test_remove_sessions_does_not_prompt_without_terminal(self):
+        manager = self.open()
+        processor = CommandProcessor([manager])
+        processor.call("add_session 01/01/2026-10:00:00 "
+                       "01/01/2026-12:00:00 false")
+        output = io.StringIO()
+        with mock.patch("builtins.input", side_effect=AssertionError), \
+                contextlib.redirect_stdout(output):
+            processor.call("Remove_Sessions 01/01/2026")
+        self.assertIn("0 -> ", output.getvalue())
+        self.assertEqual(manager.session_manager.total_unpaid, 7200)
+        processor.call("remove_sessions 01/01/2026 0")
+        self.assertEqual(manager.session_manager.total_unpaid, 0)
+        manager.close()
+
+    def test_export_rows_of_lazy_months_are_not_loaded(self):
+        manager = self.open()
+        sessions = manager.session_manager
+        for day in ("05/01/2026", "20/02/2026", "03/03/2026", "15/04/2026"):
+            sessions.add_session(day + "-10:00:00", day + "-11:30:00",
+                                 "false")
+        sessions.add_session("21/02/2026-09:00:00", "21/02/2026-10:00:00",
+                             "true")
+        expected = list(sessions.finished_rows())
+        self.assertEqual(len(expected), 5)
+        manager.compact()
+        manager.close()
+
+        manager = self.open()
+        sessions = manager.session_manager
+        # journaled change after snapshot loads March only
+        sessions.add_session("04/03/2026-10:00:00", "04/03/2026-11:00:00",
+                             "false")
+        unloaded = set(sessions.unloaded)
+        self.assertEqual(unloaded, {"2026-01", "2026-02", "2026-04"})
+        rows = list(sessions.finished_rows())
+        self.assertEqual(rows[:4] + rows[5:], expected)
+        self.assertEqual(len(rows), 6)
+        lo, hi = (sessions.parse_date("21/02/2026"),
+                  sessions.parse_date("03/03/2026"))
+        self.assertEqual(list(sessions.finished_rows(lo, hi)),
+                         expected[2:4])
+        self.assertEqual(set(sessions.unloaded), unloaded)
+        manager.close()
+
+    def test_ims_limit_counts_sessions(self):
+        manager = self.open()
+        processor = CommandProcessor([manager])
+        for hour in (8, 10, 12):
+            processor.call("add_session 01/01/2026-%02d:00:00 "
+                           "01/01/2026-%02d:30:00 false" % (hour, hour))
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            processor.call("ims --limit 2")
+        lines = output.getvalue().splitlines()
+        self.assertEqual(len([line for line in lines
+                              if line.startswith("    ")]), 2)
+        manager.close()
+
+    def test_long_session_counts_after_reopen(self):
+        manager = self.open()
+        processor = CommandProcessor([manager])
+        processor.call("add_session 30/01/2026-20:00:00 "
+                       "02/02/2026-04:00:00 false")
+        processor.call("add_session 05/03/2026-10:00:00 "
+                       "05/03/2026-11:00:00 false")
+        sessions = manager.session_manager
+        day = sessions.parse_date("02/02/2026")
+        expected = sessions.calculate_price(10, "02/02/2026")
+        self.assertEqual(expected, (4.0, 40.0))
+        manager.compact()
+        manager.close()
+
+        manager = self.open()
+        sessions = manager.session_manager
+        self.assertEqual(sessions.calculate_price(10, "02/02/2026"),
+                         expected)
+        self.assertEqual([ordinal for ordinal, _ in
+                          sessions.days_touched(day, day)], [day])
+        manager.close()
+
+    def test_failed_command_does_not_lose_changes(self):
+        commands = ["user", "10", "EUR",
+                    "add_session 01/01/2026-10:00:00 01/01/2026-12:00:00 "
+                    "false", "calc 99/99/2026", "exit"]
+        with mock.patch.object(work_manager, "getpass",
+                                  return_value="password"), \
+                mock.patch("builtins.input", side_effect=commands), \
+                mock.patch("sys.argv", ["work_manager.py"]), \
+                contextlib.redirect_stdout(io.StringIO()) as output:
+            work_manager.main()
+        self.assertIn("Wrong input type.", output.getvalue())
+        helper_methods.console_level = helper_methods.ERROR
+
+        manager = self.open()
+        self.assertEqual(manager.session_manager.calc_all(10), (2.0, 20.0))
+        manager.close()
+
+    def is_segmented(self):
+        snapshot = SegmentedFile(self.ses_file, "password")
+        snapshot.close()
+        return snapshot.is_segmented
+
+    def test_whole_file_snapshot_is_rewritten_segmented(self):
+        # file written before snapshots were segmented
+        MyCrypto.write_chunks([json.dumps({
+            "last_modified": "01/01/2026 12:00:00",
+            "hourly_price": 10,
+            "currency": "EUR",
+            "sessions": {"01/01/2026": [{
+                "start_time": "01/01/2026 10:00:00",
+                "end_time": "01/01/2026 12:00:00",
+                "paid": "false"}]}
+        }).encode('utf-8')], self.ses_file, "password")
+        manager = WorkManager(self.ses_file, "password", autosave=False,
+                              read_only=True)
+        manager.close()
+        self.assertFalse(self.is_segmented())
+
+        manager = self.open()
+        self.assertTrue(self.is_segmented())
+        manager.close()
+        manager = self.open()
+        self.assertEqual(manager.session_manager.calc_all(10), (2.0, 20.0))
+        manager.close()
+
+    def test_snapshot_is_closed_while_it_is_replaced(self):
+        manager = self.open()
+        processor = CommandProcessor([manager])
+        processor.call("add_session 01/01/2026-10:00:00 "
+                       "01/01/2026-12:00:00 false")
+        processor.call("add_session 01/02/2026-10:00:00 "
+                       "01/02/2026-11:00:00 false")
+        manager.compact()
+        manager.close()
+
+        manager = self.open()
+        self.assertTrue(manager.session_manager.unloaded)
+        snapshot = manager.snapshot
+        replace_file = MyCrypto.replace_file
+
+        def replace(*arguments):
+            # open file can't be replaced on Windows
+            self.assertTrue(snapshot.file_object.closed)
+            replace_file(*arguments)
+        with mock.patch.object(MyCrypto, "replace_file",
+                               side_effect=replace) as replaced:
+            manager.compact()
+        self.assertTrue(replaced.called)
+        self.assertEqual(manager.session_manager.calc_all(10), (3.0, 30.0))
+        manager.close()
+
+    def test_script_never_waits_for_input(self):
+        script = os.path.join(self.directory, "script")
+        with open(script, "w") as script_file:
+            script_file.write("add_session 01/01/2026-10:00:00 "
+                              "01/01/2026-12:00:00 false\n"
+                              "remove_sessions 01/01/2026\n"
+                              "bogus\n"
+                              "calc\n")
+        with mock.patch.object(work_manager, "getpass",
+                                  return_value="password"), \
+                mock.patch("builtins.input",
+                           side_effect=["user", "10", "EUR"]), \
+                mock.patch("sys.argv", ["work_manager.py", "--script",
+                                        script]), \
+                contextlib.redirect_stdout(io.StringIO()) as output, \
+                self.assertRaises(SystemExit) as exit_status:
+            work_manager.main()
+        helper_methods.console_level = helper_methods.ERROR
+        self.assertEqual(exit_status.exception.code, 1)
+        self.assertIn("Line 3 (bogus) failed", output.getvalue())
+        self.assertIn("You worked 2.0 hours", output.getvalue())
+
+    def test_histogram_and_report_agree_on_earnings(self):
+        manager = self.open()
+        processor = CommandProcessor([manager])
+        processor.call("add_session 05/01/2026-10:00:00 "
+                       "05/01/2026-12:00:00 false")
+        processor.call("add_session 06/01/2026-10:00:00 "
+                       "06/01/2026-11:00:00 true")
+        outputs = []
+        for command in ("histogram month", "report_month"):
+            with contextlib.redirect_stdout(io.StringIO()) as output:
+                processor.call(command)
+            outputs.append(output.getvalue())
+        self.assertEqual(outputs[0], outputs[1])
+        self.assertEqual(outputs[0], "01/2026: 3.0 hours (paid 1.0, "
+                         "unpaid 2.0), earned 20.0 EUR\n")
+        manager.close()
+
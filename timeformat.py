@@ -0,0 +1,109 @@
+from datetime import date, datetime, time
+from functools import lru_cache
+
+import helper_methods
+
+# Parsing and formatting of dates and times shown to the user and
+# stored in files. Formats below can be tweaked, with the default
+# ones strings in exact dd/mm/YYYY and dd/mm/YYYY HH:MM:SS layout
+# are sliced instead of going through strptime, and dates are
+# cached, since the same few dates repeat over thousands of
+# sessions. Anything else (eg. single digit day) falls back to
+# strptime, which also raises ValueError for invalid input. Times
+# are epoch seconds (see helper_methods.to_epoch) and dates are
+# date ordinals.
+
+date_format = "%d/%m/%Y"
+time_format = "%H:%M:%S"
+datetime_format = date_format + " " + time_format
+
+# slicing is used only for the layout of these formats
+default_formats = date_format == "%d/%m/%Y" and time_format == "%H:%M:%S"
+
+
+def is_digits(text):
+    return text.isdigit() and text.isascii()
+
+
+@lru_cache(maxsize=4096)
+def parse_date(text):
+    """Return date ordinal of string in date_format"""
+    if (default_formats and len(text) == 10 and text[2] == "/" and
+            text[5] == "/" and is_digits(text[0:2] + text[3:5] + text[6:10])):
+        try:
+            return date(int(text[6:10]), int(text[3:5]),
+                        int(text[0:2])).toordinal()
+        except ValueError:
+            pass
+    return datetime.strptime(text, date_format).toordinal()
+
+
+def parse_day(text):
+    """Return date of string in date_format"""
+    return date.fromordinal(parse_date(text))
+
+
+@lru_cache(maxsize=4096)
+def parse_midnight(text):
+    """Return epoch seconds of midnight of string in date_format"""
+    return helper_methods.ordinal_to_epoch(parse_date(text))
+
+
+@lru_cache(maxsize=86400)
+def parse_time(text):
+    """Return seconds since midnight of string in time_format
+
+    None is returned if it is invalid.
+    """
+    if (default_formats and len(text) == 8 and text[2] == ":" and
+            text[5] == ":" and is_digits(text[0:2] + text[3:5] + text[6:8])):
+        hours, minutes, seconds = (int(text[0:2]), int(text[3:5]),
+                                   int(text[6:8]))
+        if hours < 24 and minutes < 60 and seconds < 60:
+            return hours * 3600 + minutes * 60 + seconds
+    try:
+        parsed = datetime.strptime(text, time_format)
+    except ValueError:
+        return None
+    return parsed.hour * 3600 + parsed.minute * 60 + parsed.second
+
+
+def parse_datetime(text):
+    """Return epoch seconds of string in datetime_format
+
+    Date and time may be separated with - too, like in commands.
+    """
+    if default_formats and len(text) == 19 and text[10] in " -":
+        seconds = parse_time(text[11:])
+        if seconds is not None:
+            return parse_midnight(text[:10]) + seconds
+    try:
+        parsed = datetime.strptime(text, datetime_format)
+    except ValueError:
+        parsed = datetime.strptime(text, date_format + "-" + time_format)
+    return helper_methods.to_epoch(parsed)
+
+
+@lru_cache(maxsize=4096)
+def format_date(ordinal):
+    """Return date ordinal formatted with date_format"""
+    day = date.fromordinal(ordinal)
+    if not default_formats:
+        return day.strftime(date_format)
+    return "%02d/%02d/%04d" % (day.day, day.month, day.year)
+
+
+def format_time(seconds):
+    """Return time of day of epoch seconds in time_format"""
+    seconds %= 86400
+    if not default_formats:
+        return time(seconds // 3600, seconds // 60 % 60,
+                    seconds % 60).strftime(time_format)
+    return "%02d:%02d:%02d" % (seconds // 3600, seconds // 60 % 60,
+                               seconds % 60)
+
+
+def format_datetime(seconds):
+    """Return epoch seconds formatted with datetime_format"""
+    return (format_date(helper_methods.epoch_to_ordinal(seconds)) + " " +
+            format_time(seconds))
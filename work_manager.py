@@ -1,68 +1,124 @@
-from datetime import datetime
-from crypto import MyCrypto
+from bisect import bisect_left, bisect_right, insort
+from datetime import date, datetime, timedelta
+from aggregates import FenwickTree
+import analytics
+from autosave import AutoSaver
+from codec import get_codec
+from crypto import KeyRing, MyCrypto, SegmentedFile
 from commands import CommandProcessor
+import exporter
+from file_lock import FileLock
 import helper_methods
-import json
+import importer
+from interval_tree import IntervalTree
+from journal import Journal
+import output
+from output import OutputWriter
+from stats import Capture, stats
+import timeformat
+from timeformat import datetime_format
 from getpass import getpass
+import argparse
+import json
 import os
+import sys
+import threading
+import time
 
 prompt = "--> "
 sessions_storage = "session_files/{filename}"
+journal_storage = "{ses_file}.journal"
+lock_storage = "{ses_file}.lock"
+# journal size in bytes after which save writes a new snapshot
+journal_compact_size = 256 * 1024
+# codec new snapshots are written with, "json" or "binary"
+file_codec = "binary"
+# changes are saved in background this many seconds after the
+# last change, but at most autosave_max_delay after the first one
+autosave_delay = 1.0
+autosave_max_delay = 10.0
+# force journal and snapshot writes to disk
+fsync_writes = True
+# buckets whose rollups are cached for report_week/report_month
+rollup_buckets = ("week", "month")
+# strftime formats of first day of bucket in histogram and reports
+bucket_labels = {"day": "%d/%m/%Y", "week": "Week of %d/%m/%Y",
+                 "month": "%m/%Y"}
 """
 Do ne
 
 """
-datetime_format = "%d/%m/%Y %H:%M:%S"
-date_format = "%d/%m/%Y"
-time_format = "%H:%M:%S"
 
 
 class Session(object):
-    """Manages a single work session"""
+    """Manages a single work session
+
+    Session is kept compact, because there is one per
+    recorded session for the whole history. Times are stored
+    as epoch second ints (see helper_methods.to_epoch), and
+    start_time/end_time datetimes are built on demand.
+    """
 
-    def __init__(self, session_manager, startTime=None, endTime=None,
-                 paid=None):
+    __slots__ = ("start_ts", "end_ts", "paid")
+
+    def __init__(self, startTime=None, endTime=None, paid=None):
         """Initialize a singe session
 
         Params:
             startTime -> string -> This is string in format datetime_format
             endTime -> string -> This is string in format datetime_format
             paid -> string -> This is true/false
-            session_manager -> SessionManager -> This is sessaion manager
-            for session
 
         Internals:
-            start_time -> datetime
-            end_time -> datetime
+            start_ts -> int -> epoch seconds of start, or None
+            end_ts -> int -> epoch seconds of end, or None
             paid -> boolean
-            session_manager -> SessionManager
 
         This function initializes session. It can be unstarted session,
         or a complete session
 
         """
-        self.start_time, self.end_time = None, None
-        self.session_manager = session_manager
+        self.start_ts, self.end_ts = None, None
         # if supplied check parameter integrity
         if startTime is not None and endTime is not None:
-            self.start_time = datetime.strptime(startTime.replace("-", " "),
-                                                datetime_format)
-            self.end_time = datetime.strptime(endTime.replace("-", " "),
-                                              datetime_format)
+            self.start_ts = timeformat.parse_datetime(startTime)
+            self.end_ts = timeformat.parse_datetime(endTime)
         self.paid = False
         if paid is not None:
             if paid == "true":
                 self.paid = True
 
+    @property
+    def start_time(self):
+        if self.start_ts is None:
+            return None
+        return helper_methods.from_epoch(self.start_ts)
+
+    @start_time.setter
+    def start_time(self, value):
+        self.start_ts = None if value is None else \
+            helper_methods.to_epoch(value)
+
+    @property
+    def end_time(self):
+        if self.end_ts is None:
+            return None
+        return helper_methods.from_epoch(self.end_ts)
+
+    @end_time.setter
+    def end_time(self, value):
+        self.end_ts = None if value is None else \
+            helper_methods.to_epoch(value)
+
     def is_finished(self):
         """Check if this session is ended"""
-        if self.end_time is not None:
+        if self.end_ts is not None:
             return True
         return False
 
     def is_started(self):
         """Check if this session is started"""
-        if self.start_time is not None:
+        if self.start_ts is not None:
             return True
         return False
 
@@ -82,18 +138,22 @@ class Session(object):
         else:
             helper_methods.log(2, "Trying to stop already stopped session!")
 
-    def total_time(self):
-        """Return timedelta between beginning and end"""
+    def total_seconds(self):
+        """Return seconds between beginning and end"""
         if self.is_started():
             if self.is_finished():
-                if self.end_time < self.start_time:
+                if self.end_ts < self.start_ts:
                     raise Exception("End time must be after start time")
-                return self.end_time - self.start_time
+                return self.end_ts - self.start_ts
             else:
-                return self.current_time()
+                return self.current_time().total_seconds()
         else:
             raise Exception("This session is unstarted !")
 
+    def total_time(self):
+        """Return timedelta between beginning and end"""
+        return timedelta(seconds=self.total_seconds())
+
     def current_time(self):
         """Return time difference from now to start of session"""
         if self.is_started():
@@ -106,37 +166,63 @@ class Session(object):
     def date(self):
         """Get session date"""
         if self.is_started():
-            return self.start_time.strftime(date_format)
+            return timeformat.format_date(self.ordinal())
+        else:
+            helper_methods.log(1, "This session is unstarted")
+
+    def ordinal(self):
+        """Get session date as proleptic Gregorian ordinal
+
+        This is the key session is stored under in SessionManager
+        """
+        if self.is_started():
+            return helper_methods.epoch_to_ordinal(self.start_ts)
         else:
             helper_methods.log(1, "This session is unstarted")
 
     def total_hours(self):
         """ Return total amount of hours in this session"""
-        return self.total_time().total_seconds() / (60 * 60)
+        return self.total_seconds() / (60 * 60)
 
     def __str__(self):
         """String reperesentation of session object"""
-        if self.end_time is None:
+        if self.end_ts is None:
             endTime = "Unfinished"
         else:
-            endTime = self.end_time.strftime(datetime_format)
+            endTime = timeformat.format_datetime(self.end_ts)
 
         return "Session(START: {start_time}, END: {end_time})".format(
-            start_time=self.start_time.strftime(datetime_format),
+            start_time=timeformat.format_datetime(self.start_ts),
             end_time=endTime
 
         )
 
-    def timerange(self):
+    @staticmethod
+    def day_time(seconds, ordinal):
+        """Return time of epoch seconds as seen from date ordinal"""
+        day = helper_methods.epoch_to_ordinal(seconds)
+        if day == ordinal:
+            prefix = ""
+        elif day == ordinal + 1:
+            prefix = "Next day : "
+        elif day == ordinal - 1:
+            prefix = "Previous day : "
+        else:
+            prefix = timeformat.format_date(day) + " "
+        return prefix + timeformat.format_time(seconds)
+
+    def timerange(self, ordinal=None):
+        """Return start and end time of session
+
+        Times are shown as seen from date ordinal, which is the
+        start date of session if not given, so times on other
+        days get a prefix.
+        """
         if self.is_finished():
-            next_day = ""
-            if self.end_time.day > self.start_time.day:
-                next_day = "Next day : "  # noqa
-
-            return "%s - %s%s" % (self.start_time.strftime(time_format),
-                                  next_day,
-                                  self.end_time.strftime(time_format)
-                                  )
+            if ordinal is None:
+                ordinal = self.ordinal()
+            return "%s - %s" % (self.day_time(self.start_ts, ordinal),
+                                self.day_time(self.end_ts, ordinal))
         else:
             return "Unfinished session"
 
@@ -148,9 +234,13 @@ class Session(object):
         have serialize, and deserialize methods
         """
 
+        if self.end_ts is None:
+            end_time = None
+        else:
+            end_time = timeformat.format_datetime(self.end_ts)
         return {
-            "start_time": self.start_time.strftime(datetime_format),
-            "end_time": self.end_time.strftime(datetime_format),
+            "start_time": timeformat.format_datetime(self.start_ts),
+            "end_time": end_time,
             "paid": str(self.paid).lower()
         }
 
@@ -160,8 +250,9 @@ class Session(object):
         Return serialized data back to create instance of
         Session object
         """
-        self.start_time = datetime.strptime(dct['start_time'], datetime_format)
-        self.end_time = datetime.strptime(dct['end_time'], datetime_format)
+        self.start_ts = timeformat.parse_datetime(dct['start_time'])
+        if dct['end_time'] is not None:
+            self.end_ts = timeformat.parse_datetime(dct['end_time'])
         self.paid = True if dct['paid'] == "true" else False
         return self
 
@@ -174,9 +265,361 @@ class SessionManager(object):
     """
 
     def __init__(self):
+        # sessions are keyed by date ordinal (date.toordinal()), date_format
+        # strings are used only when printing and serializing
         self.sessions = {}
+        # sorted list of date ordinals, one per key in sessions
+        self.date_index = []
+        # start_ts of every loaded session, for duplicate checks
+        self.start_index = set()
+        # finished sessions by their [start_ts, end_ts) interval
+        self.intervals = IntervalTree()
+        self.current_session = None
+        # running totals of finished sessions seconds, split at
+        # midnights, per day [unpaid, paid] and prefix sums over days
+        self.day_totals = {}
+        self.unpaid_tree = FenwickTree()
+        self.paid_tree = FenwickTree()
+        self.total_unpaid = 0.0
+        self.total_paid = 0.0
+        # Journal changes are appended to, None if not journaled
+        self.journal = None
+        # months not loaded yet, "YYYY-MM" name -> (first, last) date
+        # ordinal, with loader returning their rows (see set_loader)
+        self.unloaded = {}
+        self.loader = None
+        # set on every change until it is saved, on_change is
+        # called after every change when set
+        self.dirty = False
+        self.on_change = None
+        # number of changes, analytics engine is rebuilt when it grows
+        self.changes = 0
+        self.engine = None
+        self.engine_changes = None
+        # cached rollups, (bucket, first day ordinal) -> (unpaid, paid)
+        # seconds, account drops the ones of days it changes
+        self.rollups = {}
+        # most days any session reaches past its start date, months
+        # of that many days before a window are loaded with it. If
+        # snapshot didn't record it, it is not known until every
+        # month was loaded, and everything before window is loaded
+        self.span_days = 1
+        self.span_known = True
+
+    @staticmethod
+    def format_date(ordinal):
+        """Return date ordinal formatted with date_format"""
+        return timeformat.format_date(ordinal)
+
+    @staticmethod
+    def parse_date(date_str):
+        """Return date ordinal of string in date_format"""
+        return timeformat.parse_date(date_str)
+
+    @staticmethod
+    def month_of(ordinal):
+        """Return "YYYY-MM" name of month date ordinal is in"""
+        day = date.fromordinal(ordinal)
+        return "%04d-%02d" % (day.year, day.month)
+
+    def set_loader(self, loader, months):
+        """Register months that are loaded when first used
+
+        Params:
+            * loader -> callable -> Takes month name, returns
+            (start_ts, end_ts, paid) rows of its sessions
+            * months -> list -> Month names in "YYYY-MM" format
+        """
+        self.loader = loader
+        for name in months:
+            year, month = int(name[:4]), int(name[5:])
+            first = date(year, month, 1)
+            if month == 12:
+                following = date(year + 1, 1, 1)
+            else:
+                following = date(year, month + 1, 1)
+            self.unloaded[name] = (first.toordinal(),
+                                   following.toordinal() - 1)
+
+    def load_month(self, name):
+        """Load sessions of month which is not loaded yet"""
+        del self.unloaded[name]
+        with stats.timer("deserialize"):
+            self.load_rows(self.loader(name))
+        if not self.unloaded:
+            self.span_known = True
+
+    def ensure_loaded(self, lo=None, hi=None):
+        """Load all months touching date ordinals lo..hi
+
+        lo and hi are inclusive, None means unbounded.
+        """
+        if not self.unloaded:
+            return
+        for name, (first, last) in list(self.unloaded.items()):
+            if (lo is None or last >= lo) and (hi is None or first <= hi):
+                self.load_month(name)
+
+    def ensure_reaching(self, lo, hi=None):
+        """Load months of sessions which may reach dates lo..hi
+
+        Sessions started up to span_days before lo may still run
+        on lo, hi is inclusive and None means unbounded.
+        """
+        if self.span_known:
+            self.ensure_loaded(lo - self.span_days, hi)
+        else:
+            self.ensure_loaded(None, hi)
+
+    def ensure_day(self, ordinal):
+        """Load month of date ordinal, if it is not loaded"""
+        if self.unloaded:
+            name = self.month_of(ordinal)
+            if name in self.unloaded:
+                self.load_month(name)
+
+    def index_date(self, ordinal):
+        """Register date ordinal in sorted date index"""
+        insort(self.date_index, ordinal)
+
+    def unindex_date(self, ordinal):
+        """Remove date ordinal from sorted date index"""
+        i = bisect_left(self.date_index, ordinal)
+        if i < len(self.date_index) and self.date_index[i] == ordinal:
+            del self.date_index[i]
+
+    def dates_between(self, d1, d2):
+        """Return date ordinals strictly between d1 and d2
+
+        Uses bisection on date index, so only dates inside
+        the window are touched.
+        """
+        self.ensure_loaded(d1.toordinal() + 1, d2.toordinal() - 1)
+        lo = bisect_right(self.date_index, d1.toordinal())
+        hi = bisect_left(self.date_index, d2.toordinal())
+        return self.date_index[lo:hi]
+
+    def account(self, session, sign=1):
+        """Add (sign=1) or subtract (sign=-1) session from totals
+
+        Only finished sessions are accounted, running session
+        is added on demand by live_seconds.
+        """
+        if not session.is_finished():
+            return
+        if session.end_ts < session.start_ts:
+            raise Exception("End time must be after start time")
+        if sign > 0:
+            span = (helper_methods.epoch_to_ordinal(session.end_ts) -
+                    helper_methods.epoch_to_ordinal(session.start_ts))
+            if span > self.span_days:
+                self.span_days = span
+        if session.paid:
+            tree, column = self.paid_tree, 1
+        else:
+            tree, column = self.unpaid_tree, 0
+        for ordinal, seconds in helper_methods.day_seconds(session.start_ts,
+                                                           session.end_ts):
+            seconds *= sign
+            day = self.day_totals.setdefault(ordinal, [0.0, 0.0])
+            day[column] += seconds
+            tree.add(ordinal, seconds)
+            if session.paid:
+                self.total_paid += seconds
+            else:
+                self.total_unpaid += seconds
+            if sign < 0 and not day[0] and not day[1]:
+                del self.day_totals[ordinal]
+            if self.rollups:
+                self.drop_rollups(ordinal)
+
+    def drop_rollups(self, ordinal):
+        """Forget cached rollups of buckets date ordinal is in"""
+        for bucket in rollup_buckets:
+            self.rollups.pop((bucket, analytics.bucket_of(ordinal, bucket)),
+                             None)
+
+    def rollup(self, bucket, key):
+        """Return (unpaid, paid) seconds of finished sessions in bucket
+
+        Params:
+            * bucket -> string -> week or month
+            * key -> int -> Date ordinal of first day of bucket
+
+        Result is cached until session of bucket changes.
+        """
+        rollup = self.rollups.get((bucket, key))
+        if rollup is None:
+            last = analytics.next_bucket(key, bucket) - 1
+            # sessions started before may continue into bucket
+            self.ensure_reaching(key, last)
+            rollup = (self.unpaid_tree.range_sum(key, last),
+                      self.paid_tree.range_sum(key, last))
+            self.rollups[(bucket, key)] = rollup
+        return rollup
+
+    def rollups_between(self, bucket, lo=None, hi=None):
+        """Return [(key, unpaid, paid)] of buckets with finished sessions
+
+        Buckets overlapping lo..hi date ordinals are returned whole,
+        all of them if bounds are None.
+        """
+        if lo is None or hi is None:
+            self.ensure_loaded()
+            if self.intervals.root is None:
+                return []
+            if lo is None:
+                lo = self.date_index[0]
+            if hi is None:
+                hi = helper_methods.epoch_to_ordinal(
+                    self.intervals.root.max_end - 1)
+        result = []
+        key = analytics.bucket_of(lo, bucket)
+        while key <= hi:
+            unpaid, paid = self.rollup(bucket, key)
+            if unpaid or paid:
+                result.append((key, unpaid, paid))
+            key = analytics.next_bucket(key, bucket)
+        return result
+
+    def set_paid(self, session, paid):
+        """Change paid state of session keeping totals in sync"""
+        if session.paid != paid:
+            self.account(session, -1)
+            session.paid = paid
+            self.account(session)
+
+    def live_seconds(self, lo=None, hi=None):
+        """Unpaid seconds of running session on dates lo..hi"""
+        session = self.current_session
+        if session is None or session.paid:
+            return 0.0
+        seconds = 0.0
+        now = helper_methods.to_epoch(datetime.today())
+        for ordinal, part in helper_methods.day_seconds(session.start_ts,
+                                                        now):
+            if ((lo is None or ordinal >= lo) and
+                    (hi is None or ordinal <= hi)):
+                seconds += part
+        return seconds
+
+    def journal_op(self, op, **fields):
+        """Append operation to journal, if there is one
+
+        This marks manager dirty, every change goes through here.
+        """
+        if self.journal is not None:
+            self.journal.append(op, **fields)
+        self.dirty = True
+        self.changes += 1
+        if self.on_change is not None:
+            self.on_change()
+
+    def file_session(self, session):
+        """Register session under its date"""
+        ordinal = session.ordinal()
+        self.ensure_day(ordinal)
+        if ordinal in self.sessions:
+            self.sessions[ordinal].append(session)
+        else:
+            self.sessions[ordinal] = [session]
+            self.index_date(ordinal)
+        self.start_index.add(session.start_ts)
+        if session.is_finished():
+            self.intervals.insert(session.start_ts, session.end_ts, session)
+        self.account(session)
+
+    def close_session(self, session):
+        """Register end of running session"""
+        self.intervals.insert(session.start_ts, session.end_ts, session)
+        self.account(session)
         self.current_session = None
 
+    def unfile_session(self, session):
+        """Unregister session from its date"""
+        ordinal = session.ordinal()
+        self.sessions[ordinal].remove(session)
+        self.start_index.discard(session.start_ts)
+        self.intervals.remove(session)
+        if len(self.sessions[ordinal]) == 0:
+            del self.sessions[ordinal]
+            self.unindex_date(ordinal)
+        self.account(session, -1)
+        if session is self.current_session:
+            self.current_session = None
+
+    def sessions_in(self, date1=None, date2=None):
+        """Yield sessions selected like in mark_paid arguments"""
+        if date1 is not None and date2 is not None:
+            ordinals = self.dates_between(
+                timeformat.parse_day(date1),
+                timeformat.parse_day(date2))
+        elif date1 is not None and date2 is None:
+            ordinals = [self.parse_date(date1)]
+            self.ensure_day(ordinals[0])
+        else:
+            self.ensure_loaded()
+            ordinals = list(self.date_index)
+        for ordinal in ordinals:
+            for session in self.sessions.get(ordinal, ()):
+                yield session
+
+    def replay(self, record):
+        """Apply journal record to sessions
+
+        Records are applied exactly as they were recorded,
+        without printing and without journaling them again.
+        """
+        op = record["op"]
+        if op == "start":
+            session = Session()
+            session.start_ts = record["at"]
+            self.current_session = session
+            self.file_session(session)
+        elif op == "stop":
+            if self.current_session is not None:
+                self.current_session.end_ts = record["at"]
+                self.close_session(self.current_session)
+        elif op == "add":
+            session = Session()
+            session.start_ts = record["start"]
+            session.end_ts = record["end"]
+            session.paid = record["paid"]
+            self.file_session(session)
+        elif op == "import":
+            for start_ts, end_ts, paid in record["rows"]:
+                session = Session()
+                session.start_ts, session.end_ts = start_ts, end_ts
+                session.paid = paid
+                self.file_session(session)
+        elif op == "remove":
+            for start_ts in record["starts"]:
+                ordinal = helper_methods.epoch_to_ordinal(start_ts)
+                self.ensure_day(ordinal)
+                for session in list(self.sessions.get(ordinal, ())):
+                    if session.start_ts == start_ts:
+                        self.unfile_session(session)
+        elif op == "mark":
+            for session in self.sessions_in(record["date1"],
+                                            record["date2"]):
+                self.set_paid(session, record["paid"])
+
+    def analytics(self):
+        """Return analytics engine over finished sessions
+
+        Engine is NumPy based if numpy is installed (see analytics),
+        and it is built again only after sessions changed.
+        """
+        if self.engine is None or self.engine_changes != self.changes:
+            self.engine = analytics.engine_for(self)
+            self.engine_changes = self.changes
+        return self.engine
+
+    def unpaid_result(self, per_hour, seconds):
+        """Return (hours, price) tuple for unpaid seconds"""
+        hours = seconds / (60 * 60)
+        return (hours, hours * per_hour)
+
     def start_session(self):
         """Start the session
 
@@ -185,13 +628,10 @@ class SessionManager(object):
         Register session to a sessions dictionary
         """
         if self.current_session is None:
-            self.current_session = Session(self)
+            self.current_session = Session()
             self.current_session.start()
-            ses_date = self.current_session.date()
-            if ses_date in self.sessions:
-                self.sessions[ses_date].append(self.current_session)
-            else:
-                self.sessions[ses_date] = [self.current_session]
+            self.file_session(self.current_session)
+            self.journal_op("start", at=self.current_session.start_ts)
 
         else:
             helper_methods.log(2, "One session is currently active")
@@ -202,8 +642,10 @@ class SessionManager(object):
         If there is a session running then stop it
         """
         if self.current_session is not None:
-            self.current_session.stop()
-            self.current_session = None
+            session = self.current_session
+            session.stop()
+            self.close_session(session)
+            self.journal_op("stop", at=session.end_ts)
         else:
             helper_methods.log(2, "No session is started")
 
@@ -217,47 +659,31 @@ class SessionManager(object):
     def calc_range(self, per_hour, d1, d2):
         """Calulate price and total hours of date range
 
-        Find all sessions that fit in date range, and calc
-        price and total working hours for them.
+        Sum unpaid seconds of days strictly inside date range
+        from prefix sums, and calc price and total working
+        hours for them.
         """
-        final_price = 0.0
-        total_hours = 0.0
-        for date, sessions in self.sessions.items():
-            if (datetime.strptime(date, date_format) > d1 and
-                    datetime.strptime(date, date_format) < d2):
-                for session in sessions:
-                    if session.paid is False:
-                        total_hours += session.total_hours()
-                        final_price += session.total_hours() * per_hour
-
-        return (total_hours, final_price)
+        lo = d1.toordinal() + 1
+        hi = d2.toordinal() - 1
+        # sessions started before may continue into range
+        self.ensure_reaching(lo, hi)
+        seconds = self.unpaid_tree.range_sum(lo, hi)
+        seconds += self.live_seconds(lo, hi)
+        return self.unpaid_result(per_hour, seconds)
 
     def calc_all(self, per_hour):
         """Calculate all from beginning"""
-        final_price = 0.0
-        total_hours = 0.0
-        for date, sessions in self.sessions.items():
-            for session in sessions:
-                if session.paid is False:
-                    total_hours += session.total_hours()
-                    final_price += session.total_hours() * per_hour
-
-        return (total_hours, final_price)
+        self.ensure_loaded()
+        seconds = self.total_unpaid + self.live_seconds()
+        return self.unpaid_result(per_hour, seconds)
 
     def calc_one(self, per_hour, date):
         """Get time of just one session"""
-        date_str = datetime.strftime(date, date_format)
-        total_hours = 0
-        total_price = 0
-        if date_str in self.sessions:
-            for session in self.sessions[date_str]:
-                if session.paid is False:
-                    total_hours += session.total_hours()
-                    total_price += session.total_hours() * per_hour
-
-            return (total_hours, total_price)
-        else:
-            return (0, 0)
+        ordinal = date.toordinal()
+        self.ensure_reaching(ordinal, ordinal)
+        seconds = self.day_totals.get(ordinal, [0.0, 0.0])[0]
+        seconds += self.live_seconds(ordinal, ordinal)
+        return self.unpaid_result(per_hour, seconds)
 
     def calculate_price(self, per_hour, date1=None, date2=None):
         """Calculate price for sessions in date1
@@ -271,224 +697,641 @@ class SessionManager(object):
         This is interface to above functions
         """
         if date1 is not None and date2 is not None:
-            d1 = datetime.strptime(date1, date_format)
-            d2 = datetime.strptime(date2, date_format)
+            d1 = timeformat.parse_day(date1)
+            d2 = timeformat.parse_day(date2)
             return self.calc_range(per_hour, d1, d2)
         elif date1 is not None and date2 is None:
-            d1 = datetime.strptime(date1, date_format)
+            d1 = timeformat.parse_day(date1)
             return self.calc_one(per_hour, d1)
         else:
             return self.calc_all(per_hour)
 
-    def ps_range(self, d1, d2):
-        for date, sessions in self.sessions.items():
-            if (datetime.strptime(date, date_format) > d1 and
-                    datetime.strptime(date, date_format) < d2):
-                print("Date: %s" % date)
-                for session in sessions:
-                    print(" |---%s , %s" % (
-                        session.timerange(),
-                        "Paid" if session.paid else "Unpaid"
-                    ))
-
-    def ps_one(self, date):
-        date_str = datetime.strftime(date, date_format)
-        if date_str in self.sessions:
-            print("Date: %s" % date_str)
-            for session in self.sessions[date_str]:
-                print(" |---%s , %s" % (
-                    session.timerange(),
-                    "Paid" if session.paid else "Unpaid"
-                ))
-        else:
-            print("No sessions are registered at that date")
+    def days_touched(self, lo, hi):
+        """Return [(ordinal, sessions)] of dates lo..hi with sessions
 
-    def ps_all(self):
-        for date, sessions in self.sessions.items():
-            print("Date: %s" % date)
+        Sessions crossing midnight are listed on every day they
+        touch, before sessions started on that day.
+        """
+        self.ensure_reaching(lo, hi)
+        days = {}
+        for session in self.intervals.overlapping(
+                helper_methods.ordinal_to_epoch(lo),
+                helper_methods.ordinal_to_epoch(hi + 1)):
+            first = session.ordinal()
+            for ordinal, seconds in helper_methods.day_seconds(
+                    session.start_ts, session.end_ts):
+                if ordinal != first and lo <= ordinal <= hi:
+                    days.setdefault(ordinal, []).append(session)
+        for ordinal in self.date_index[bisect_left(self.date_index, lo):
+                                       bisect_right(self.date_index, hi)]:
+            days.setdefault(ordinal, []).extend(self.sessions[ordinal])
+        return sorted(days.items())
+
+    def print_days(self, days, writer, limit=None):
+        """Write sessions of days to writer, at most limit of them"""
+        left = limit
+        for ordinal, sessions in days:
+            if writer.stopped:
+                return
+            if left is not None:
+                if left <= 0:
+                    writer.write("... output limited to %s sessions" % limit)
+                    return
+                sessions = sessions[:left]
+                left -= len(sessions)
+            writer.write("Date: %s" % self.format_date(ordinal))
             for session in sessions:
-                print(" |---%s , %s" % (
-                    session.timerange(),
+                writer.write(" |---%s , %s" % (
+                    session.timerange(ordinal),
                     "Paid" if session.paid else "Unpaid"
                 ))
 
-    def print_sessions(self, date1=None, date2=None):
+    def ps_range(self, d1, d2, writer, limit=None, since=None):
+        lo = d1.toordinal() + 1
+        if since is not None:
+            lo = max(lo, since)
+        self.print_days(self.days_touched(lo, d2.toordinal() - 1),
+                        writer, limit)
+
+    def ps_one(self, date, writer, limit=None):
+        days = self.days_touched(date.toordinal(), date.toordinal())
+        if days:
+            self.print_days(days, writer, limit)
+        else:
+            writer.write("No sessions are registered at that date")
+
+    def ps_all(self, writer, limit=None, since=None):
+        if since is None:
+            self.ensure_loaded()
+        else:
+            self.ensure_reaching(since)
+        if self.date_index:
+            first, last = self.date_index[0], self.date_index[-1]
+            if self.intervals.root is not None:
+                last = max(last, helper_methods.epoch_to_ordinal(
+                    self.intervals.root.max_end - 1))
+            if since is not None:
+                first = max(first, since)
+            self.print_days(self.days_touched(first, last), writer, limit)
+
+    def print_sessions(self, date1=None, date2=None, writer=None, limit=None,
+                       since=None):
+        """Print sessions of date, dates between date1 and date2, or all
+
+        Params:
+            * writer -> OutputWriter -> Where sessions are written,
+            stdout if not supplied
+            * limit -> int -> Most sessions to print
+            * since -> int -> Date ordinal of first date to print
+        """
+        if writer is None:
+            with OutputWriter() as writer:
+                return self.print_sessions(date1, date2, writer, limit,
+                                           since)
         if date1 is not None and date2 is not None:
-            d1 = datetime.strptime(date1, date_format)
-            d2 = datetime.strptime(date2, date_format)
-            self.ps_range(d1, d2)
+            d1 = timeformat.parse_day(date1)
+            d2 = timeformat.parse_day(date2)
+            self.ps_range(d1, d2, writer, limit, since)
         elif date1 is not None and date2 is None:
-            d1 = datetime.strptime(date1, date_format)
-            self.ps_one(d1)
+            d1 = timeformat.parse_day(date1)
+            if since is None or d1.toordinal() >= since:
+                self.ps_one(d1, writer, limit)
         else:
-            self.ps_all()
+            self.ps_all(writer, limit, since)
 
     def mp_range(self, d1, d2, paid):
-        for date, sessions in self.sessions.items():
-            if (datetime.strptime(date, date_format) > d1 and
-                    datetime.strptime(date, date_format) < d2):
-                for session in sessions:
-                    session.paid = paid
+        for ordinal in self.dates_between(d1, d2):
+            for session in self.sessions[ordinal]:
+                self.set_paid(session, paid)
         print("Sessions marked as %s" % ("paid" if paid else "unpaid"))
 
     def mp_one(self, date, paid):
-        date_str = datetime.strftime(date, date_format)
-        if date_str in self.sessions:
-            for session in self.sessions[date_str]:
-                session.paid = paid
+        ordinal = date.toordinal()
+        self.ensure_day(ordinal)
+        if ordinal in self.sessions:
+            for session in self.sessions[ordinal]:
+                self.set_paid(session, paid)
             print("Sessions marked as %s" % ("paid" if paid else "unpaid"))
         else:
             print("No sessions are registered at that date")
 
     def mp_all(self, paid):
-        for date, sessions in self.sessions.items():
-            for session in sessions:
-                session.paid = paid
+        self.ensure_loaded()
+        for ordinal in self.date_index:
+            for session in self.sessions[ordinal]:
+                self.set_paid(session, paid)
         print("Sessions marked as %s" % ("paid" if paid else "unpaid"))
 
     def mark_paid(self, date1=None, date2=None):
+        # dates are parsed before anything is changed or journaled,
+        # so invalid date never gets into journal
         if date1 is not None and date2 is not None:
-            d1 = datetime.strptime(date1, date_format)
-            d2 = datetime.strptime(date2, date_format)
+            d1 = timeformat.parse_day(date1)
+            d2 = timeformat.parse_day(date2)
             self.mp_range(d1, d2, True)
         elif date1 is not None and date2 is None:
-            d1 = datetime.strptime(date1, date_format)
+            d1 = timeformat.parse_day(date1)
             self.mp_one(d1, True)
         else:
             self.mp_all(True)
+        self.journal_op("mark", paid=True, date1=date1, date2=date2)
 
     def mark_unpaid(self, date1=None, date2=None):
+        # dates are parsed before anything is changed or journaled,
+        # so invalid date never gets into journal
         if date1 is not None and date2 is not None:
-            d1 = datetime.strptime(date1, date_format)
-            d2 = datetime.strptime(date2, date_format)
+            d1 = timeformat.parse_day(date1)
+            d2 = timeformat.parse_day(date2)
             self.mp_range(d1, d2, False)
         elif date1 is not None and date2 is None:
-            d1 = datetime.strptime(date1, date_format)
+            d1 = timeformat.parse_day(date1)
             self.mp_one(d1, False)
         else:
             self.mp_all(False)
+        self.journal_op("mark", paid=False, date1=date1, date2=date2)
 
     def add_session(self, startTime=None, endTime=None, paid=None):
         if startTime is not None and endTime is not None and paid is not None:
-            session = Session(self, startTime, endTime, paid)
-            date = session.date()
-            if date not in self.sessions:
-                self.sessions[date] = [session]
-                print("Session added successfully!")
+            session = Session(startTime, endTime, paid)
+            self.ensure_day(session.ordinal())
+            if session.start_ts in self.start_index:
+                print("Session with same start time already exists!")
+            elif session.end_ts < session.start_ts:
+                print("End time must be after start time")
+            elif self.overlaps(session):
+                print("Session overlaps existing session!")
             else:
-                contains = False
-                for ses in self.sessions[date]:
-                    if ses.start_time == session.start_time:
-                        contains = True
-                if not contains:
-                    self.sessions[date].append(session)
-                    print("Session added successfully!")
-                else:
-                    print("Session with same start time already exists!")
+                self.file_session(session)
+                self.journal_op("add", start=session.start_ts,
+                                end=session.end_ts, paid=session.paid)
+                print("Session added successfully!")
 
         else:
             print("Please specify start and end time")
 
-    def remove_sessions(self, date):
-        if date in self.sessions:
-            mapper = {}
-            print("Here are sessions for this date:")
-            for i in range(0, len(self.sessions[date])):
-                session = self.sessions[date][i]
-                print(" " * 4 + str(i) + " -> " + session.timerange())
-                mapper[i] = self.sessions[date][i]
-            print("Enter , separated numbers of sessions")
-            delete = [int(a.strip()) for a in input(prompt).split(',')]
+    def overlaps(self, session):
+        """Check if session overlaps any registered session
+
+        Months of sessions which may reach dates from session
+        start up to the day of its end are loaded first.
+        """
+        start_ts, end_ts = session.start_ts, session.end_ts
+        self.ensure_reaching(session.ordinal(),
+                             helper_methods.epoch_to_ordinal(end_ts))
+        if self.intervals.overlapping(start_ts, end_ts):
+            return True
+        running = self.current_session
+        return (running is not None and running.start_ts < end_ts and
+                start_ts < helper_methods.to_epoch(datetime.today()))
+
+    def import_sessions(self, rows):
+        """Add many sessions at once
+
+        Params:
+            * rows -> iterable -> (line, startTime, endTime, paid)
+            tuples, with arguments like in add_session
+
+        Sessions with bad format, same start time as another one,
+        or overlapping another one are rejected. Accepted ones are
+        journaled as single record.
+        Return (accepted, rejected) lists, accepted has Sessions
+        and rejected (line, reason) tuples.
+        """
+        batch, rejected = [], []
+        seen = set()
+        for line, startTime, endTime, paid in rows:
+            try:
+                session = Session(startTime, endTime, paid)
+                if (not session.is_finished() or
+                        session.end_ts < session.start_ts):
+                    raise ValueError()
+            except (ValueError, AttributeError, TypeError):
+                rejected.append((line, "bad format"))
+                continue
+            self.ensure_day(session.ordinal())
+            if (session.start_ts in self.start_index or
+                    session.start_ts in seen):
+                rejected.append((line, "duplicate start time"))
+                continue
+            seen.add(session.start_ts)
+            batch.append((line, session))
+
+        accepted = []
+        batch.sort(key=lambda item: item[1].start_ts)
+        batch_end = None
+        for line, session in batch:
+            if ((batch_end is not None and session.start_ts < batch_end) or
+                    self.overlaps(session)):
+                rejected.append((line, "overlaps other session"))
+                continue
+            accepted.append(session)
+            batch_end = session.end_ts
+        for session in accepted:
+            self.file_session(session)
+        if accepted:
+            self.journal_op("import", rows=[
+                [session.start_ts, session.end_ts, session.paid]
+                for session in accepted])
+        return accepted, sorted(rejected)
+
+    def remove_sessions(self, date, indices=None, interactive=True):
+        """Remove sessions of date
+
+        Params:
+            * date -> string -> String in format date_format
+            * indices -> string -> , separated numbers of sessions
+            in that date, if not supplied they are asked for
+            * interactive -> bool -> If False, missing indices are
+            not asked for, sessions are only listed
+        """
+        ordinal = self.parse_date(date)
+        self.ensure_day(ordinal)
+        if ordinal in self.sessions:
+            mapper = dict(enumerate(self.sessions[ordinal]))
+            if indices is None:
+                print("Here are sessions for this date:")
+                for i, session in mapper.items():
+                    print(" " * 4 + str(i) + " -> " + session.timerange())
+                if not interactive:
+                    print("Add , separated numbers of sessions to "
+                          "remove_sessions to remove them")
+                    return
+                print("Enter , separated numbers of sessions")
+                indices = input(prompt)
+            delete = [int(a.strip()) for a in indices.split(',')]
+            removed = []
             for d in delete:
                 if d in mapper:
-                    self.sessions[date].remove(mapper[d])
-            if len(self.sessions[date]) == 0:
-                del self.sessions[date]
+                    self.unfile_session(mapper[d])
+                    removed.append(mapper.pop(d).start_ts)
+            if removed:
+                self.journal_op("remove", starts=removed)
+            print("Removed %s sessions" % len(removed))
+        else:
+            print("No sessions are registered at that date")
 
-    def serialize(self):
-        """Serializer of the class"""
-        return {date: [session.serialize() for session in lst] for
-                (date, lst) in self.sessions.items()}
+    def finished_rows(self, lo=None, hi=None):
+        """Yield (start_ts, end_ts, paid) of finished sessions
+
+        Only sessions started on date ordinals lo..hi (inclusive,
+        None is unbounded) are yielded, in date order. Months which
+        are not loaded are decoded one at a time straight from
+        loader without filing them, so memory use doesn't grow with
+        history.
+        """
+        index = self.date_index
+        position = 0 if lo is None else bisect_left(index, lo)
+        last = len(index) if hi is None else bisect_right(index, hi)
+        months = sorted(
+            (first, name) for name, (first, end) in self.unloaded.items()
+            if (lo is None or end >= lo) and (hi is None or first <= hi))
+        for first, name in months + [(None, None)]:
+            # loaded dates before this month
+            while position < last and (first is None or
+                                       index[position] < first):
+                for session in self.sessions[index[position]]:
+                    if session.is_finished():
+                        yield (session.start_ts, session.end_ts,
+                               session.paid)
+                position += 1
+            if name is None:
+                break
+            for start_ts, end_ts, paid in self.loader(name):
+                ordinal = helper_methods.epoch_to_ordinal(start_ts)
+                if (end_ts is not None and (lo is None or ordinal >= lo) and
+                        (hi is None or ordinal <= hi)):
+                    yield start_ts, end_ts, paid
+
+    def month_rows(self):
+        """Yield (month name, rows) of loaded months in date order"""
+        current, rows = None, []
+        for ordinal in self.date_index:
+            name = self.month_of(ordinal)
+            if name != current:
+                if rows:
+                    yield current, rows
+                current, rows = name, []
+            rows.extend((session.start_ts, session.end_ts, session.paid)
+                        for session in self.sessions[ordinal])
+        if rows:
+            yield current, rows
+
+    def load_rows(self, rows):
+        """Add sessions from (start_ts, end_ts, paid) rows"""
+        for start_ts, end_ts, paid in rows:
+            session = Session()
+            session.start_ts, session.end_ts = start_ts, end_ts
+            session.paid = paid
+            if end_ts is None:
+                self.current_session = session
+            self.file_session(session)
+
+    def from_columns(self, rows):
+        """Load sessions from (start_ts, end_ts, paid) rows"""
+        sessions = []
+        for start_ts, end_ts, paid in rows:
+            session = Session()
+            session.start_ts, session.end_ts = start_ts, end_ts
+            session.paid = paid
+            sessions.append(session)
+        return self.restore(sessions)
+
+    def restore(self, sessions):
+        """Replace all sessions with given Session objects"""
+        self.sessions = {}
+        self.start_index = set()
+        finished = []
+        for session in sessions:
+            self.sessions.setdefault(session.ordinal(), []).append(session)
+            self.start_index.add(session.start_ts)
+            if session.is_finished():
+                finished.append((session.start_ts, session.end_ts, session))
+        self.date_index = sorted(self.sessions)
+        self.intervals.build(finished)
+        for ordinal in self.date_index:
+            for session in self.sessions[ordinal]:
+                if session.is_finished():
+                    self.account(session)
+                else:
+                    self.current_session = session
+        return self
 
     def deserialize(self, dct):
         """Deserializer of the class"""
-        self.sessions = {
-            date: [Session(session_manager=self).deserialize(session_data) for
-                   session_data in lst] for (date, lst) in dct.items()}
-        return self
+        return self.restore(
+            Session().deserialize(session_data)
+            for lst in dct.values() for session_data in lst)
 
 
 class WorkManager(object):
     """ Main class for CMD and managing files"""
 
-    def __init__(self):
+    def __init__(self, ses_file=None, password=None, hourly_price=None,
+                 currency=None, autosave=True, read_only=False,
+                 interactive=None):
+        """Open session file, creating it if it doesn't exist
+
+        Params:
+            * ses_file -> string -> Path of session file
+            * password -> string -> Password of session file
+            * hourly_price -> float -> Hourly price for new file
+            * currency -> string -> Currency for new file
+            * autosave -> boolean -> Save changes in background,
+            otherwise they are saved only by close
+            * read_only -> boolean -> Only read existing file, it is
+            not locked, journal is not repaired and changes are
+            never saved, so file can be read while other process
+            has it open
+            * interactive -> boolean -> Ask on terminal for input
+            commands are missing and retry wrong password, by
+            default only if password is not supplied
+
+        Anything not supplied is asked for interactively. If
+        manager is not interactive, wrong password raises ValueError
+        instead of asking again. Session file is locked until
+        close, IOError is raised if other process has it open.
+
+        Changes are saved by autosave thread, commands and other
+        code changing state from another thread must hold
+        state_lock.
+        """
         self.password_tries = 3
-        print(
-            "Please enter the name of your session "
-            "file or name of one you want to create:"
-        )
-        self.ses_file = sessions_storage.format(
-            filename=input(prompt)
-        )
+        self.interactive = (password is None if interactive is None
+                            else interactive)
+        self.read_only = read_only
+        if ses_file is None:
+            print(
+                "Please enter the name of your session "
+                "file or name of one you want to create:"
+            )
+            ses_file = sessions_storage.format(
+                filename=input(prompt)
+            )
+        self.ses_file = ses_file
+        self.state_lock = threading.RLock()
+        self.journal = None
+        self.autosaver = AutoSaver(self.flush, autosave_delay,
+                                   autosave_max_delay)
+        self.lock = FileLock(lock_storage.format(ses_file=self.ses_file))
+        if not read_only:
+            self.lock.acquire()
+        try:
+            self.open(password, hourly_price, currency)
+        except BaseException:
+            self.lock.release()
+            raise
+        if autosave and not read_only:
+            self.autosaver.start()
+
+    def open(self, password, hourly_price, currency):
+        """Load session file, or create it for new user"""
         if(os.path.exists(self.ses_file)):
-            print("Enter your password")
             self.new_user = False
+            if password is None:
+                print("Enter your password")
+        elif self.read_only:
+            raise IOError("%s doesn't exist" % self.ses_file)
         else:
-            print(
-                "Enter your new password for "
-                "encrypting/decrypting of this file"
-            )
             self.new_user = True
-
-        self.password = getpass(prompt)
+            if password is None:
+                print(
+                    "Enter your new password for "
+                    "encrypting/decrypting of this file"
+                )
+
+        if password is None:
+            password = getpass(prompt)
+        # derived keys are cached here for the lifetime of WorkManager
+        self.keyring = KeyRing(password)
         if self.new_user is True:
-            print("Enter your hourly price without currency")
-            self.hourly_price = float(input(prompt))
-            print("Enter currency")
-            self.currency = input(prompt)
+            if hourly_price is None:
+                print("Enter your hourly price without currency")
+                hourly_price = input(prompt)
+            self.hourly_price = float(hourly_price)
+            if currency is None:
+                print("Enter currency")
+                currency = input(prompt)
+            self.currency = currency
             self.session_manager = SessionManager()
-            self.saved = 0
+            self.journal = Journal(
+                journal_storage.format(ses_file=self.ses_file),
+                self.keyring)
+            self.session_manager.journal = self.journal
+            self.session_manager.on_change = self.autosaver.touch
+            self.snapshot = None
+            self.compact()
         else:
+            self.snapshot = None
             self.load()
 
-    def serialize(self):
-        """Class serializer"""
-        ret = {
+    def meta(self):
+        """Return everything serialized except sessions"""
+        current = self.session_manager.current_session
+        return {
+            "current_session": None if current is None else current.start_ts,
             "last_modified": datetime.now().strftime(datetime_format),
             "hourly_price": self.hourly_price,
-            "sessions": self.session_manager.serialize(),
-            "currency": self.currency
+            "currency": self.currency,
+            "journal_seq": self.journal.seq,
+            "span_days": (self.session_manager.span_days
+                          if self.session_manager.span_known else None)
         }
-        return ret
 
     def deserialize(self, dct):
         """Class deserializer"""
-        print(dct)
         self.last_modified = dct['last_modified']
-        self.session_manager = SessionManager().deserialize(dct['sessions'])
-        self.saved = 0
+        with stats.timer("deserialize"):
+            self.session_manager = SessionManager().deserialize(
+                dct['sessions'])
         self.currency = dct['currency']
         self.hourly_price = float(dct['hourly_price'])
+        self.journal_seq = dct.get('journal_seq', 0)
         return self
         # print(self.sessions)
 
+    def restore(self, meta, rows):
+        """Load state from meta dict and session rows (see codec)"""
+        with stats.timer("deserialize"):
+            session_manager = SessionManager().from_columns(rows)
+        return self.restore_meta(meta, session_manager)
+
+    def restore_meta(self, meta, session_manager):
+        """Load state from meta dict and session manager"""
+        self.last_modified = meta['last_modified']
+        self.session_manager = session_manager
+        self.currency = meta['currency']
+        self.hourly_price = float(meta['hourly_price'])
+        self.journal_seq = meta.get('journal_seq', 0)
+        return self
+
+    def replay_record(self, record):
+        """Apply journal record while loading, skipping invalid one
+
+        Record that can't be applied (eg. written by older version
+        which journaled invalid dates) is reported and skipped, it
+        must not make the file look corrupt or password wrong.
+        """
+        try:
+            self.replay(record)
+        except (ValueError, KeyError, TypeError) as e:
+            helper_methods.log(1, "Skipped journal record %s (%s): %s" %
+                               (record.get("seq"), record.get("op"), e))
+
+    def replay(self, record):
+        """Apply journal record"""
+        if record["op"] == "price":
+            self.hourly_price = record["value"]
+        else:
+            self.session_manager.replay(record)
+
+    def compact(self):
+        """Write new snapshot of everything and drop old journal
+
+        Journal is rotated first, so records made while snapshot
+        is written go to a fresh journal. Rotated journal is
+        removed only after snapshot is safely in place.
+        Old snapshot is closed before it is replaced, open file
+        can't be replaced on Windows, and months not loaded yet
+        are loaded from the new one.
+        """
+        codec = get_codec(file_codec)
+        with self.state_lock:
+            journal = self.journal
+            seq = journal.rotate()
+            manager = self.session_manager
+            with stats.timer("serialize"):
+                loaded = {name: codec.encode_rows(rows)
+                          for (name, rows) in manager.month_rows()}
+            segments = [("meta", [json.dumps(self.meta()).encode('utf-8')])]
+            for name in sorted(set(loaded) | set(manager.unloaded)):
+                if name in loaded:
+                    segments.append((name, loaded[name]))
+                else:
+                    # month was never loaded, copy it from old snapshot
+                    segments.append((name, self.copy_segment(
+                        self.snapshot, name, codec)))
+        with stats.timer("save.snapshot"):
+            temp_name = MyCrypto.write_segments(
+                segments, self.ses_file, self.keyring,
+                extra={"codec": codec.name}, fsync=fsync_writes,
+                replace=False)
+            with self.state_lock:
+                if self.snapshot is not None:
+                    self.snapshot.close()
+                try:
+                    MyCrypto.replace_file(temp_name, self.ses_file,
+                                          fsync_writes)
+                finally:
+                    # old file is opened again if replace failed
+                    self.snapshot = SegmentedFile(self.ses_file, self.keyring)
+                    self.session_manager.loader = self.snapshot_loader(
+                        self.snapshot)
+        journal.discard(seq)
+
+    @staticmethod
+    def copy_segment(snapshot, name, codec):
+        """Yield month segment of snapshot encoded with codec"""
+        data = snapshot.read_segment(name)
+        old_codec = get_codec(snapshot.fields.get("codec"))
+        if old_codec is codec:
+            yield data
+        else:
+            for piece in codec.encode_rows(old_codec.decode_rows(data)):
+                yield piece
+
     def save(self):
-        print(self.serialize())
-        MyCrypto.write_to_file(
-            json.dumps(obj=self.serialize()),
-            self.ses_file,
-            self.password
-        )
+        """Save working state in background as soon as possible"""
+        self.autosaver.touch(now=True)
+
+    def flush(self):
+        """Write unsaved changes, this runs in autosave thread
+
+        Changes are appended to journal, and new snapshot is
+        written once journal grows big enough.
+        """
+        journal = self.journal
+        if self.session_manager.dirty:
+            self.session_manager.dirty = False
+            with stats.timer("save.journal"):
+                journal.flush(fsync_writes)
+        if journal.size() > journal_compact_size:
+            self.compact()
 
     def load(self):
         try:
-            decrypted = MyCrypto.read_from_file(
-                self.ses_file,
-                self.password
-            )
-            self.deserialize(json.loads(decrypted))
+            start = time.perf_counter()
+            if self.journal is not None:
+                self.journal.flush(fsync_writes)
+            if self.snapshot is not None:
+                self.snapshot.close()
+                self.snapshot = None
+            snapshot = SegmentedFile(self.ses_file, self.keyring)
+            if snapshot.is_segmented:
+                self.load_segmented(snapshot)
+            else:
+                snapshot.close()
+                fields, decrypted = MyCrypto.read_with_header(
+                    self.ses_file,
+                    self.keyring
+                )
+                get_codec(fields.get("codec")).decode(decrypted, self)
+            self.journal = Journal(
+                journal_storage.format(ses_file=self.ses_file),
+                self.keyring)
+            for record in self.journal.replay(self.journal_seq,
+                                              not self.read_only):
+                self.replay_record(record)
+            self.session_manager.journal = self.journal
+            self.session_manager.on_change = self.autosaver.touch
+            if not snapshot.is_segmented and not self.read_only:
+                # rewrite old whole file snapshot once, so next loads
+                # decrypt only months they use
+                self.compact()
+            stats.add_time("load", time.perf_counter() - start)
             helper_methods.log(3, "Loaded config from file")
         except ValueError  as e:  # noqa
+            if not self.interactive:
+                raise
             self.password_tries -= 1
             if self.password_tries == 0:
                 exit("File you try to open is corrupt or password "
@@ -498,9 +1341,42 @@ class WorkManager(object):
                             "you can do it {tries} more times").format(
                 tries=self.password_tries
             ))
-            self.password = getpass(prompt)
+            self.keyring.clear()
+            self.keyring = KeyRing(getpass(prompt))
             self.load()
 
+    def close(self):
+        """Save changes, forget keys and unlock file"""
+        if not self.read_only:
+            self.autosaver.stop()
+        if self.snapshot is not None:
+            self.snapshot.close()
+        self.keyring.clear()
+        self.lock.release()
+
+    @staticmethod
+    def snapshot_loader(snapshot):
+        """Return function loading rows of month segment of snapshot"""
+        codec = get_codec(snapshot.fields.get("codec"))
+        return lambda name: codec.decode_rows(snapshot.read_segment(name))
+
+    def load_segmented(self, snapshot):
+        """Load meta of segmented snapshot, months are loaded lazily"""
+        meta = json.loads(snapshot.read_segment("meta"))
+        manager = SessionManager()
+        manager.set_loader(
+            self.snapshot_loader(snapshot),
+            [name for name in snapshot.names() if name != "meta"])
+        self.restore_meta(meta, manager)
+        if meta.get("span_days") is None:
+            manager.span_known = not manager.unloaded
+        else:
+            manager.span_days = meta["span_days"]
+        if meta.get("current_session") is not None:
+            manager.ensure_day(
+                helper_methods.epoch_to_ordinal(meta["current_session"]))
+        self.snapshot = snapshot
+
     def cmd_save(self, arguments):
         """Save working state"""
         self.save()
@@ -509,14 +1385,45 @@ class WorkManager(object):
         try:
             cijena = float(arguments[0])
             self.hourly_price = cijena
+            self.session_manager.journal_op("price", value=cijena)
             print("Hourly price changed to %s %s" %
                   (self.hourly_price, self.currency)
                   )
         except:
             print("Price must be int of floating point number")
 
+    def output_options(self, arguments):
+        """Return (arguments, options) of command with output options
+
+        Options are described in output.parse_options, since is
+        converted to date ordinal. Return None if they are invalid.
+        """
+        try:
+            arguments, options = output.parse_options(arguments)
+            if options["since"] is not None:
+                options["since"] = self.session_manager.parse_date(
+                    options["since"])
+        except ValueError as e:
+            print(e)
+            return None
+        return arguments, options
+
     def cmd_print_sessions(self, arguments):
-        self.session_manager.print_sessions(*arguments)
+        """Print sessions
+
+        Params:
+            arguments -> list -> optional date or start and end
+            date, and output options --limit N, --since DATE,
+            --page and --out FILE
+        """
+        parsed = self.output_options(arguments)
+        if parsed is None:
+            return
+        arguments, options = parsed
+        with OutputWriter.open(options["out"], options["page"]) as writer:
+            self.session_manager.print_sessions(
+                *arguments, writer=writer, limit=options["limit"],
+                since=options["since"])
 
     def cmd_start(self, arguments):
         """Start a new session"""
@@ -562,9 +1469,171 @@ class WorkManager(object):
             *arguments
         )
 
+    def cmd_import(self, arguments):
+        """Import sessions from csv or json lines file"""
+        if len(arguments) != 1:
+            print("Please specify file to import")
+            return
+        try:
+            accepted, rejected = self.session_manager.import_sessions(
+                importer.read_rows(arguments[0]))
+        except (IOError, UnicodeDecodeError) as e:
+            print("Can't read import file: %s" % e)
+            return
+        print("Imported %s sessions, rejected %s" %
+              (len(accepted), len(rejected)))
+        for line, reason in rejected[:20]:
+            print(" |---line %s: %s" % (line, reason))
+        if len(rejected) > 20:
+            print(" |---... and %s more" % (len(rejected) - 20))
+        if accepted:
+            self.save()
+
+    def cmd_export(self, arguments):
+        """Export finished sessions to csv, json lines or columnar file
+
+        Params:
+            arguments -> list -> file name, optional start and end
+            date, and options --format csv/jsonl/columnar (from file
+            extension by default) and --encrypt (with password of
+            session file)
+        """
+        file_format, encrypt, rest = None, False, []
+        arguments = iter(arguments)
+        for argument in arguments:
+            if argument == "--format":
+                file_format = next(arguments, None)
+            elif argument == "--encrypt":
+                encrypt = True
+            elif argument:
+                rest.append(argument)
+        if len(rest) not in (1, 3):
+            print("Please specify file to export to, and optionally "
+                  "start and end date")
+            return
+        try:
+            lo, hi = self.date_bounds(rest[1:])
+            count = exporter.export(
+                self.session_manager.finished_rows(lo, hi), rest[0],
+                file_format, self.keyring if encrypt else None)
+        except (ValueError, IOError) as e:
+            print("Can't export: %s" % e)
+            return
+        print("Exported %s sessions" % count)
+
+    def date_bounds(self, arguments):
+        """Return (lo, hi) ordinals strictly between two date arguments
+
+        (None, None) is returned if dates are not supplied.
+        """
+        if len(arguments) < 2:
+            return None, None
+        manager = self.session_manager
+        return (manager.parse_date(arguments[0]) + 1,
+                manager.parse_date(arguments[1]) - 1)
+
+    def cmd_histogram(self, arguments):
+        """Print hours and earnings per day, week or month
+
+        Params:
+            arguments -> list -> day/week/month, and optional
+            start and end date
+        """
+        if not arguments or arguments[0] not in analytics.BUCKETS:
+            print("Please specify day, week or month")
+            return
+        bucket = arguments[0]
+        lo, hi = self.date_bounds(arguments[1:])
+        self.print_buckets(bucket, self.session_manager.analytics(
+            ).histogram(bucket, lo, hi))
+
+    def print_buckets(self, bucket, totals):
+        """Print hours and earnings of days, weeks or months
+
+        Params:
+            * bucket -> string -> day, week or month
+            * totals -> list -> (first day ordinal, unpaid, paid)
+            seconds of buckets
+
+        Earned is amount for unpaid hours, like in calc.
+        """
+        for key, unpaid, paid in totals:
+            print("{label}: {hours} hours (paid {paid}, unpaid {unpaid}), "
+                  "earned {amount} {currency}".format(
+                      label=date.fromordinal(key).strftime(
+                          bucket_labels[bucket]),
+                      hours=round((unpaid + paid) / 3600, 2),
+                      paid=round(paid / 3600, 2),
+                      unpaid=round(unpaid / 3600, 2),
+                      amount=round(unpaid / 3600 * self.hourly_price, 2),
+                      currency=self.currency))
+
+    def cmd_moving_avg(self, arguments):
+        """Print moving average of hours worked per day
+
+        Params:
+            arguments -> list -> window in days, and optional
+            start and end date, last 30 days by default
+        """
+        try:
+            window = int(arguments[0])
+            if window < 1:
+                raise ValueError()
+        except (IndexError, ValueError):
+            print("Please specify window in days")
+            return
+        lo, hi = self.date_bounds(arguments[1:])
+        if lo is None:
+            hi = date.today().toordinal()
+            lo = hi - 29
+        for ordinal, hours in self.session_manager.analytics(
+                ).moving_average(window, lo, hi):
+            print("%s: %s hours/day" % (self.session_manager.format_date(
+                ordinal), round(hours, 2)))
+
+    def print_rollups(self, bucket, arguments):
+        """Print hours and earnings of every week or month in range"""
+        lo, hi = self.date_bounds(arguments)
+        self.print_buckets(bucket, self.session_manager.rollups_between(
+            bucket, lo, hi))
+
+    def cmd_report_week(self, arguments):
+        """Print weekly rollups
+
+        Params:
+            arguments -> list -> optional start and end date
+        """
+        self.print_rollups("week", arguments)
+
+    def cmd_report_month(self, arguments):
+        """Print monthly rollups
+
+        Params:
+            arguments -> list -> optional start and end date
+        """
+        self.print_rollups("month", arguments)
+
+    def cmd_stats(self, arguments):
+        """Print timers and counters of this process
+
+        Params:
+            arguments -> list -> optional histograms to print
+            buckets of every timer, or reset to clear them
+        """
+        if arguments and arguments[0] == "reset":
+            stats.reset()
+            print("Stats cleared")
+            return
+        lines = stats.report(histograms=bool(arguments) and
+                             arguments[0] == "histograms")
+        if not lines:
+            print("Nothing was measured yet")
+        for line in lines:
+            print(line)
+
     def cmd_remove_sessions(self, arguments):
         self.session_manager.remove_sessions(
-            *arguments
+            *arguments[:2], interactive=self.interactive
         )
 
     def cmd_mark_paid(self, arguments):
@@ -574,33 +1643,132 @@ class WorkManager(object):
         self.session_manager.mark_unpaid(*arguments)
 
     def cmd_ims(self, arguments):
-        for date, session in self.session_manager.sessions.items():
-            helper_methods.log(3, date + "===" + str([
-                str(ses) for ses in session
-            ]))
+        """Print sessions as they are stored in memory
+
+        Params:
+            arguments -> list -> output options like print_sessions
+        """
+        parsed = self.output_options(arguments)
+        if parsed is None:
+            return
+        options = parsed[1]
+        manager = self.session_manager
+        since = options["since"]
+        manager.ensure_loaded(since)
+        first = 0 if since is None else bisect_left(manager.date_index, since)
+        left = options["limit"]
+        with OutputWriter.open(options["out"], options["page"]) as writer:
+            for ordinal in manager.date_index[first:]:
+                if writer.stopped:
+                    break
+                sessions = manager.sessions[ordinal]
+                if left is not None:
+                    if left <= 0:
+                        writer.write("... output limited to %s sessions" %
+                                     options["limit"])
+                        break
+                    sessions = sessions[:left]
+                    left -= len(sessions)
+                writer.write(manager.format_date(ordinal) + "===")
+                for session in sessions:
+                    writer.write("    " + str(session))
+
+
+def run_script(WM, CP, file_name):
+    """Run commands from script file, - is stdin
+
+    Return number of failed commands.
+    """
+    if file_name == "-":
+        with WM.state_lock:
+            return CP.run_script(sys.stdin)
+    with open(file_name) as script:
+        with WM.state_lock:
+            return CP.run_script(script)
+
+
+def add_logging_arguments(parser):
+    """Add log options to argparse parser"""
+    levels = [name.lower() for name in helper_methods.level_names]
+    parser.add_argument("--log-file", metavar="FILE",
+                        help="write log messages to FILE too, it is "
+                        "rotated when it grows over 1 MB")
+    parser.add_argument("--log-level", choices=levels, default="info",
+                        help="least important level written to log file")
+    parser.add_argument("--console-level", choices=levels, default="info",
+                        help="least important level printed")
+    parser.add_argument("--log-json", action="store_true",
+                        help="write log file as json lines")
+
+
+def setup_logging_from_arguments(args):
+    """Configure helper_methods.log from parsed log options"""
+    levels = [name.lower() for name in helper_methods.level_names]
+    helper_methods.setup_logging(args.log_file,
+                                 levels.index(args.log_level),
+                                 levels.index(args.console_level),
+                                 args.log_json)
 
 
 def main():
     """Initialize the work manager """
+    parser = argparse.ArgumentParser(
+        description="Manage your work sessions easily and securely")
+    parser.add_argument("--script", metavar="FILE",
+                        help="run commands from FILE (- for stdin) "
+                        "instead of prompting for them, then exit")
+    parser.add_argument("--profile", metavar="FILE",
+                        help="profile commands with cProfile into FILE")
+    parser.add_argument("--trace-memory", metavar="FILE",
+                        help="write biggest memory allocations to FILE")
+    add_logging_arguments(parser)
+    args = parser.parse_args()
+    setup_logging_from_arguments(args)
+    capture = None
+    if args.profile is not None:
+        capture = Capture("profile", args.profile)
+    elif args.trace_memory is not None:
+        capture = Capture("memory", args.trace_memory)
+    if capture is not None:
+        capture.start()
+    WM = None
     try:
 
-        WM = WorkManager()
+        # scripts may run without terminal, commands never wait for
+        # input there
+        WM = WorkManager(interactive=args.script is None)
         CP = CommandProcessor([WM])
+        if args.script is not None:
+            failed = run_script(WM, CP, args.script)
+            sys.exit(1 if failed else 0)
         while 1:
             try:
                 cmd = input(prompt)
                 if cmd == "exit":
                     raise KeyboardInterrupt()
-                CP.call(cmd)
-            except KeyboardInterrupt:
+                with WM.state_lock:
+                    CP.call(cmd)
+            except (KeyboardInterrupt, EOFError):
                 print()
-                if WM.saved == 0:
-                    WM.save()
-                helper_methods.log(3, "\nBye bye")
                 break
+            # failed command must not end the program, changes
+            # not saved yet would be lost
+            except ValueError as e:
+                print(e)
+                print("Wrong input type.")
+            except IOError as e:
+                print(e)
+        helper_methods.log(3, "\nBye bye")
     except ValueError as e:
         print(e)
         print("Wrong input type.")
+    except IOError as e:
+        print(e)
+    finally:
+        if WM is not None:
+            WM.close()
+        if capture is not None:
+            capture.stop()
 
 
 if __name__ == "__main__":